@@ -0,0 +1,134 @@
+import argparse
+import json
+import sys
+import time
+from random import Random
+from typing import Any, Callable, Optional, Sequence
+
+from chess_puzzle_final import (Bishop, Board, King, Rook, conf2unicode, generate_legal_moves, is_check, is_checkmate,
+                                make_move, read_board, unmake_move)
+
+# Move-generation benchmark and regression suite: perft node counts on reference positions must match the
+# stored baseline exactly, and the timed throughputs must not fall more than a threshold below it
+
+BASELINE_FILE = "bench_baseline.json"
+
+def perft(B : Board, side : bool, depth : int) -> int:
+    '''counts the positions reached from B after depth plies of legal moves, side moving first'''
+    if depth == 0:
+        return 1
+    nodes = 0
+    for piece, x, y in list(generate_legal_moves(side, B)):
+        undo = make_move(piece, x, y, B)
+        try:
+            nodes += perft(B, not side, depth - 1)
+        finally:
+            unmake_move(undo, B)
+    return nodes
+
+def generated_board(size : int, piece_count : int, seed : int) -> Board:
+    '''
+    returns a reproducible random board of the given size with both kings and piece_count rooks and bishops,
+    with Black (not to move) out of check whenever the board is large enough for that
+    '''
+    rng = Random(seed)
+    squares = [(x, y) for x in range(1, size+1) for y in range(1, size+1)]
+    while True:
+        chosen = rng.sample(squares, piece_count + 2)
+        pieces = [King(chosen[0][0], chosen[0][1], True), King(chosen[1][0], chosen[1][1], False)]
+        for x, y in chosen[2:]:
+            pieces.append(rng.choice([Rook, Bishop])(x, y, rng.random() < 0.5))
+        B = (size, pieces)
+        if size <= 2 or not is_check(False, B):
+            return B
+
+def reference_positions() -> dict[str, tuple[Board, int]]:
+    '''returns the reference boards by name, each with the perft depth it is benchmarked at'''
+    return {
+        "board_examp": (read_board("board_examp.txt"), 3),
+        "size2_kings": (generated_board(2, 0, 2), 1),
+        "size8_6pieces": (generated_board(8, 4, 8), 3),
+        "size8_12pieces": (generated_board(8, 10, 88), 2),
+        "size16_10pieces": (generated_board(16, 8, 16), 2),
+        "size26_8pieces": (generated_board(26, 6, 26), 2),
+        "size26_24pieces": (generated_board(26, 22, 2626), 1),
+    }
+
+def rate(function : Callable[[], Any], min_seconds : float) -> float:
+    '''returns how many times per second function runs, timed over at least min_seconds'''
+    calls = 0
+    start = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < min_seconds or calls == 0:
+        function()
+        calls += 1
+        elapsed = time.perf_counter() - start
+    return calls / elapsed
+
+def run_benchmarks(min_seconds : float = 0.2) -> dict[str, dict[str, Any]]:
+    '''runs perft and the is_check / is_checkmate / conf2unicode micro-benchmarks on every reference position'''
+    results = {}
+    for name, (B, depth) in reference_positions().items():
+        start = time.perf_counter()
+        nodes = perft(B, True, depth)
+        elapsed = time.perf_counter() - start
+        results[name] = {
+            "size": B[0],
+            "pieces": len(B[1]),
+            "depth": depth,
+            "nodes": nodes,
+            "perft_nodes_per_second": nodes / elapsed if elapsed > 0 else 0.0,
+            "is_check_per_second": rate(lambda: is_check(True, B), min_seconds),
+            "is_checkmate_per_second": rate(lambda: is_checkmate(True, B), min_seconds),
+            "conf2unicode_per_second": rate(lambda: conf2unicode(B), min_seconds),
+        }
+    return results
+
+def compare(results : dict[str, dict[str, Any]], baseline : dict[str, dict[str, Any]], threshold : float) -> list[str]:
+    '''
+    returns a description of every regression of results against baseline:
+    node counts that differ, and throughputs more than threshold (a fraction) below the baseline
+    '''
+    failures = []
+    for name, expected in baseline.items():
+        if name not in results:
+            failures.append(f"{name}: missing from results")
+            continue
+        result = results[name]
+        if (result["depth"], result["nodes"]) != (expected["depth"], expected["nodes"]):
+            failures.append(f"{name}: perft({expected['depth']}) gave {result['nodes']} nodes, expected {expected['nodes']}")
+        for key, value in expected.items():
+            if key.endswith("_per_second") and result[key] < value * (1 - threshold):
+                failures.append(f"{name}: {key} {result[key]:.0f} is more than {threshold:.0%} below {value:.0f}")
+    return failures
+
+def main(argv : Optional[Sequence[str]] = None) -> int:
+    ''' runs the benchmarks, writes them as JSON and compares them with the baseline '''
+    parser = argparse.ArgumentParser(description="Benchmark move generation and check detection against a baseline.")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="baseline JSON file")
+    parser.add_argument("--write-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.5, help="allowed throughput drop, as a fraction")
+    parser.add_argument("--output", help="file to write the JSON results to (standard output by default)")
+    parser.add_argument("--min-seconds", type=float, default=0.2, help="minimum time of each micro-benchmark")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.min_seconds)
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as out:
+            out.write(output + "\n")
+    else:
+        print(output)
+
+    if args.write_baseline:
+        with open(args.baseline, "w") as out:
+            out.write(output + "\n")
+        return 0
+    with open(args.baseline) as baseline_file:
+        failures = compare(results, json.load(baseline_file), args.threshold)
+    for failure in failures:
+        print(f"REGRESSION {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
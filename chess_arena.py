@@ -0,0 +1,88 @@
+import argparse
+import json
+import random
+import time
+from multiprocessing import Pool
+from typing import Any, Optional, Sequence
+
+from chess_puzzle_final import Board, PackedBoard, find_black_move, pack_board, play_game, random_player, read_board, unpack_board
+
+# Arena: many games from one starting board between two move providers, shared out across a process pool
+# every game seeds the random module from the arena seed and its own number, so a run with random players is reproducible
+
+PLAYERS = ("random", "search")
+
+GameTask = tuple[PackedBoard, str, str, Optional[int], int, int, float] # (board, white, black, move cap, seed, game, search time)
+
+def make_player(name : str, side : bool, search_time : float = 0.1) -> Any:
+    '''
+    returns the move provider of side named name: "random" plays a random legal move (find_black_move for Black),
+    "search" a chess_search.SearchPlayer thinking for search_time seconds per move
+    raises ValueError for any other name
+    '''
+    if name == "random":
+        return random_player(True) if side else find_black_move
+    elif name == "search":
+        from chess_search import SearchPlayer
+        return SearchPlayer(time_limit=search_time, side=side)
+    raise ValueError(f"unknown player {name!r}, expected one of {PLAYERS}")
+
+def _play(task : GameTask) -> tuple[str, int]:
+    '''worker: plays one game of the arena'''
+    packed, white, black, max_moves, seed, game, search_time = task
+    random.seed(f"{seed}:{game}")
+    return play_game(unpack_board(packed), make_player(white, True, search_time), make_player(black, False, search_time), max_moves)
+
+def run_arena(B : Board, games : int, white : str = "random", black : str = "random", max_moves : Optional[int] = 200,
+              seed : int = 0, workers : int = 1, search_time : float = 0.1) -> dict[str, Any]:
+    '''
+    plays games games from board B (which is left untouched) and returns the number and rate of White wins, Black wins and draws,
+    the average game length in moves and the games played per second
+    with workers > 1 the games are shared out across a process pool
+    '''
+    for name in (white, black):
+        if name not in PLAYERS:
+            raise ValueError(f"unknown player {name!r}, expected one of {PLAYERS}")
+    packed = pack_board(B)
+    tasks = [(packed, white, black, max_moves, seed, game, search_time) for game in range(games)]
+    start = time.perf_counter()
+    if workers > 1:
+        with Pool(workers) as pool:
+            results = pool.map(_play, tasks, chunksize=max(1, games // (4 * workers)))
+    else:
+        results = list(map(_play, tasks))
+    elapsed = time.perf_counter() - start
+    counts = {"white": 0, "black": 0, "draw": 0}
+    for result, _ in results:
+        counts[result] += 1
+    return {
+        "games": games,
+        "white_wins": counts["white"],
+        "black_wins": counts["black"],
+        "draws": counts["draw"],
+        "white_win_rate": counts["white"] / games if games else 0.0,
+        "black_win_rate": counts["black"] / games if games else 0.0,
+        "draw_rate": counts["draw"] / games if games else 0.0,
+        "average_moves": sum(moves for _, moves in results) / games if games else 0.0,
+        "seconds": elapsed,
+        "games_per_second": games / elapsed if elapsed > 0 else 0.0,
+    }
+
+def main(argv : Optional[Sequence[str]] = None) -> None:
+    ''' plays many games from a plain board file and prints the aggregated results as JSON '''
+    parser = argparse.ArgumentParser(description="Play many games between two move providers from one board.")
+    parser.add_argument("filename", help="plain board configuration file")
+    parser.add_argument("--games", type=int, default=1000, help="number of games")
+    parser.add_argument("--white", choices=PLAYERS, default="random", help="White move provider")
+    parser.add_argument("--black", choices=PLAYERS, default="random", help="Black move provider")
+    parser.add_argument("--max-moves", type=int, default=200, help="moves (of either side) after which a game is a draw")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random players")
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes")
+    parser.add_argument("--search-time", type=float, default=0.1, help="seconds per move of search players")
+    args = parser.parse_args(argv)
+    summary = run_arena(read_board(args.filename), args.games, args.white, args.black, args.max_moves,
+                        args.seed, args.workers, args.search_time)
+    print(json.dumps(summary, indent=2))
+
+if __name__ == '__main__':
+    main()
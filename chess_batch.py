@@ -0,0 +1,134 @@
+import argparse
+import glob
+import json
+import os
+import sys
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, Iterable, Iterator, Optional, Sequence, TextIO
+
+from chess_puzzle_final import Board, generate_legal_moves, is_check, parse_board, split_records
+
+# Batch validation of plain board files: sources -> records -> (parse, validate, classify) -> JSONL
+# every stage is a generator and at most a bounded number of records is in flight, so memory stays flat
+
+Record = tuple[str, list[str], Optional[str]] # (record id, the three lines of one plain board configuration, read error)
+
+def iter_paths(target : str) -> Iterator[str]:
+    '''yields the files named by target: every file of a directory, the matches of a glob, or a single file'''
+    if os.path.isdir(target):
+        for name in sorted(os.listdir(target)):
+            path = os.path.join(target, name)
+            if os.path.isfile(path):
+                yield path
+    elif glob.has_magic(target):
+        yield from sorted(glob.iglob(target, recursive=True))
+    else:
+        yield target
+
+def iter_records(paths : Iterable[str]) -> Iterator[Record]:
+    '''
+    yields every board configuration of every file, reading the files line by line
+    a file may hold several configurations one after another, optionally separated by blank lines (see split_records);
+    records are named after their file, with #k appended for the k-th configuration after the first
+    a record that is not valid UTF-8 is yielded with a read error, and the rest of its file is still read
+    '''
+    for path in paths:
+        try:
+            with open(path, "rb") as plain_boards:
+                count = 0
+                for record in split_records(plain_boards):
+                    source = path if count == 0 else f"{path}#{count}"
+                    count += 1
+                    try:
+                        lines = [line.decode() for line in record]
+                    except UnicodeDecodeError:
+                        yield (source, [], "not valid UTF-8")
+                        continue
+                    yield (source, lines, None)
+                if count == 0:
+                    yield (path, [], None) # an empty file, reported as not valid
+        except OSError as error:
+            yield (path, [], error.strerror or str(error))
+
+def classify(side : bool, B : Board) -> str:
+    '''returns "checkmate", "check", "stalemate-like" (no legal move without being in check) or "normal" for side on B'''
+    in_check = is_check(side, B)
+    has_move = any(True for _ in generate_legal_moves(side, B))
+    if in_check:
+        return "check" if has_move else "checkmate"
+    return "normal" if has_move else "stalemate-like"
+
+def validate_record(record : Record) -> dict[str, Any]:
+    '''parses, validates and classifies one record, returning its JSON-ready result'''
+    source, lines, read_error = record
+    if read_error is not None:
+        return {"source": source, "valid": False, "reason": f"cannot read file: {read_error}"}
+    try:
+        B = parse_board(lines)
+    except IOError as error:
+        return {"source": source, "valid": False, "reason": str(error) or "invalid board configuration"}
+    if is_check(True, B) and is_check(False, B):
+        return {"source": source, "valid": False, "reason": "both kings are in check"}
+    return {"source": source, "valid": True, "size": B[0], "pieces": len(B[1]),
+            "white": classify(True, B), "black": classify(False, B)}
+
+def validate_stream(records : Iterable[Record], workers : int = 1, max_pending : int = 256) -> Iterator[dict[str, Any]]:
+    '''
+    yields the result of every record, in order
+    with workers > 1 the records are validated across a process pool with at most max_pending of them in flight
+    '''
+    if workers <= 1:
+        yield from map(validate_record, records)
+        return
+    with ProcessPoolExecutor(workers) as pool:
+        pending : deque[Future] = deque()
+        for record in records:
+            pending.append(pool.submit(validate_record, record))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def write_jsonl(results : Iterable[dict[str, Any]], out : TextIO) -> dict[str, int]:
+    '''writes every result to out as one JSON line as soon as it arrives and returns the counts of valid and invalid records'''
+    counts = {"valid": 0, "invalid": 0}
+    for result in results:
+        out.write(json.dumps(result) + "\n")
+        out.flush()
+        counts["valid" if result["valid"] else "invalid"] += 1
+    return counts
+
+def profiled(results : Iterable[dict[str, Any]], profiler : Any) -> Iterator[dict[str, Any]]:
+    '''yields every result, closing a profiler summary per record'''
+    for result in results:
+        profiler.end_move(result["source"])
+        yield result
+
+def main(argv : Optional[Sequence[str]] = None) -> None:
+    ''' validates every board configuration of a directory, glob or multi-board file '''
+    parser = argparse.ArgumentParser(description="Validate and classify plain board configurations in bulk.")
+    parser.add_argument("target", help="directory, glob pattern or (multi-board) plain board file")
+    parser.add_argument("-o", "--output", help="JSONL file to write (standard output by default)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="number of worker processes")
+    parser.add_argument("--profile", choices=("table", "json"),
+                        help="profile the hot functions, in a single process, and print the summary to standard error")
+    args = parser.parse_args(argv)
+    if args.profile:
+        import chess_profile
+        profiler = chess_profile.enable()
+        results = profiled(validate_stream(iter_records(iter_paths(args.target))), profiler)
+    else:
+        results = validate_stream(iter_records(iter_paths(args.target)), workers=args.workers)
+    if args.output:
+        with open(args.output, "w") as out:
+            counts = write_jsonl(results, out)
+        print(f"{counts['valid']} valid, {counts['invalid']} invalid board configurations")
+    else:
+        write_jsonl(results, sys.stdout)
+    if args.profile:
+        chess_profile.disable()
+        print(profiler.report(args.profile), file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+from functools import lru_cache
+from typing import Iterator, Tuple
+
+from chess_puzzle_final import GEOMETRY_CACHE_SIZE, Board, Piece
+
+# Bitboard engine: each (side, piece type) is stored as one Python int of S*S bits,
+# bit (y-1)*S + (x-1) being set when such a piece stands on square (x, y)
+
+PIECE_TYPES = ("K", "R", "B")
+
+ROOK_DIRECTIONS = ((0, 1), (0, -1), (-1, 0), (1, 0))
+BISHOP_DIRECTIONS = ((-1, 1), (1, 1), (-1, -1), (1, -1))
+KING_DIRECTIONS = ROOK_DIRECTIONS + BISHOP_DIRECTIONS
+
+def square2bit(pos_X : int, pos_Y : int, size : int) -> int:
+    '''converts coordinates pos_X, pos_Y on a board of the given size to the bit of that square'''
+    return 1 << ((pos_Y - 1) * size + (pos_X - 1))
+
+def bit2square(bit : int, size : int) -> tuple[int, int]:
+    '''converts a single set bit back to the coordinates of its square'''
+    index = bit.bit_length() - 1
+    return (index % size + 1, index // size + 1)
+
+def iter_bits(bitboard : int) -> Iterator[int]:
+    '''yields every set bit of bitboard as an int of its own, lowest first'''
+    while bitboard:
+        bit = bitboard & -bitboard
+        yield bit
+        bitboard ^= bit
+
+@lru_cache(maxsize=GEOMETRY_CACHE_SIZE)
+def edge_masks(size : int) -> tuple[int, int, int]:
+    '''returns the masks of the whole board, of every square off the first file and of every square off the last file'''
+    full = (1 << (size * size)) - 1
+    first_file = sum(1 << (row * size) for row in range(size))
+    return (full, full ^ first_file, full ^ (first_file << (size - 1)))
+
+class BitBoard:
+    '''board configuration held as per-side, per-piece-type bitboards'''
+    size : int
+    pieces : dict[tuple[bool, str], int]
+
+    def __init__(self, size : int, pieces : dict[tuple[bool, str], int]):
+        '''sets initial values and the masks used to shift bitboards without wrapping round the board edges'''
+        self.size = size
+        self.pieces = pieces
+        self.full, self.not_first_file, self.not_last_file = edge_masks(size)
+
+    @classmethod
+    def from_board(cls, B : Board) -> 'BitBoard':
+        '''builds the bitboards of board B'''
+        size = B[0]
+        pieces = {(side, piece_type): 0 for side in (True, False) for piece_type in PIECE_TYPES}
+        for piece in B[1]:
+            pieces[(piece.side, piece.letter)] |= square2bit(piece.pos_x, piece.pos_y, size)
+        return cls(size, pieces)
+
+    def occupied_by(self, side : bool) -> int:
+        '''returns the bitboard of every square holding a piece of side'''
+        return self.pieces[(side, "K")] | self.pieces[(side, "R")] | self.pieces[(side, "B")]
+
+    def shift(self, bitboard : int, dx : int, dy : int) -> int:
+        '''moves every bit of bitboard one step in direction dx, dy, dropping bits that leave the board'''
+        if dx == 1:
+            bitboard = (bitboard << 1) & self.not_first_file
+        elif dx == -1:
+            bitboard = (bitboard >> 1) & self.not_last_file
+        if dy == 1:
+            bitboard = (bitboard << self.size) & self.full
+        elif dy == -1:
+            bitboard = bitboard >> self.size
+        return bitboard
+
+    def ray_attacks(self, sliders : int, empty : int, directions : Tuple[tuple[int, int], ...]) -> int:
+        '''
+        returns every square attacked by the sliders along the given directions
+        each ray is filled by shifting and masking with the empty squares until it hits a piece or the edge
+        '''
+        attacks = 0
+        for dx, dy in directions:
+            ray = self.shift(sliders, dx, dy)
+            while ray:
+                attacks |= ray
+                ray = self.shift(ray & empty, dx, dy)
+        return attacks
+
+    def piece_attacks(self, piece_type : str, bits : int, empty : int) -> int:
+        '''returns every square attacked by pieces of piece_type standing on bits'''
+        if piece_type == "R":
+            return self.ray_attacks(bits, empty, ROOK_DIRECTIONS)
+        elif piece_type == "B":
+            return self.ray_attacks(bits, empty, BISHOP_DIRECTIONS)
+        attacks = 0
+        for dx, dy in KING_DIRECTIONS:
+            attacks |= self.shift(bits, dx, dy)
+        return attacks
+
+    def attacks(self, side : bool) -> int:
+        '''returns every square attacked by the pieces of side'''
+        empty = self.full ^ (self.occupied_by(True) | self.occupied_by(False))
+        attacks = 0
+        for piece_type in PIECE_TYPES:
+            attacks |= self.piece_attacks(piece_type, self.pieces[(side, piece_type)], empty)
+        return attacks
+
+    def is_check(self, side : bool) -> bool:
+        '''checks if this configuration is check for side'''
+        return self.attacks(not side) & self.pieces[(side, "K")] != 0
+
+    def targets(self, side : bool, piece_type : str, bit : int) -> int:
+        '''returns the squares the piece of side and piece_type on bit can reach according to [Rule1]-[Rule4]'''
+        empty = self.full ^ (self.occupied_by(True) | self.occupied_by(False))
+        return self.piece_attacks(piece_type, bit, empty) & ~self.occupied_by(side)
+
+    def after_move(self, side : bool, piece_type : str, from_bit : int, to_bit : int) -> 'BitBoard':
+        '''returns the configuration after the piece of side and piece_type moves from from_bit to to_bit'''
+        pieces = dict(self.pieces)
+        pieces[(side, piece_type)] ^= from_bit | to_bit
+        for enemy_type in PIECE_TYPES:
+            pieces[(not side, enemy_type)] &= ~to_bit
+        return BitBoard(self.size, pieces)
+
+    def is_legal(self, side : bool, piece_type : str, from_bit : int, to_bit : int) -> bool:
+        '''checks if the piece of side and piece_type on from_bit can move to to_bit according to all chess rules'''
+        if not self.targets(side, piece_type, from_bit) & to_bit:
+            return False
+        return not self.after_move(side, piece_type, from_bit, to_bit).is_check(side)
+
+    def legal_moves(self, side : bool) -> Iterator[tuple[str, int, int]]:
+        '''yields (piece type, from bit, to bit) for every legal move of side'''
+        for piece_type in PIECE_TYPES:
+            for from_bit in iter_bits(self.pieces[(side, piece_type)]):
+                for to_bit in iter_bits(self.targets(side, piece_type, from_bit)):
+                    if not self.after_move(side, piece_type, from_bit, to_bit).is_check(side):
+                        yield (piece_type, from_bit, to_bit)
+
+    def is_checkmate(self, side : bool) -> bool:
+        '''checks if this configuration is checkmate for side'''
+        for _ in self.legal_moves(side):
+            return False
+        return True
+
+# Functions with the same names and signatures as the piece engine in chess_puzzle_final
+
+def is_check(side : bool, B : Board) -> bool:
+    ''' checks if configuration of B is check for side '''
+    return BitBoard.from_board(B).is_check(side)
+
+def is_checkmate(side : bool, B : Board) -> bool:
+    ''' checks if configuration of B is checkmate for side '''
+    return BitBoard.from_board(B).is_checkmate(side)
+
+def can_move_to(piece : Piece, pos_X : int, pos_Y : int, B : Board) -> bool:
+    '''
+    checks if piece can move to coordinates pos_X, pos_Y
+    on board B according to all chess rules
+    '''
+    size = B[0]
+    if not (1 <= pos_X <= size and 1 <= pos_Y <= size):
+        return False
+    bits = BitBoard.from_board(B)
+    return bits.is_legal(piece.side, piece.letter, square2bit(piece.pos_x, piece.pos_y, size), square2bit(pos_X, pos_Y, size))
@@ -0,0 +1,138 @@
+import argparse
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from random import Random
+from typing import Any, Iterator, Optional, Sequence
+
+from chess_puzzle_final import Bishop, Board, King, PieceList, Position, Rook, is_check, save_board
+from chess_solver import solve_mate
+from chess_tablebase import Slots, parse_signature
+
+# Puzzle generator: samples legal boards of one size and material, keeps those where White to move forces mate,
+# and streams the new ones to disk; batches of samples are shared out across worker processes, each seeded from
+# the generator seed and its batch number so that a run is reproducible whatever the number of workers
+
+Batch = tuple[int, str, int, bool, int, int, int] # (board size, material signature, mate moves, exact, seed, batch, samples)
+
+MAX_SAMPLES = 100_000 # default cap on the samples of a run, which could otherwise go on forever for material that cannot mate
+
+def sample_board(size : int, slots : Slots, rng : Random) -> Optional[Board]:
+    '''
+    returns a board of the given size with the pieces of slots on distinct random squares, None when Black,
+    not to move, is in check there (an illegal configuration) or the pieces do not fit on the board
+    '''
+    if len(slots) > size * size:
+        return None
+    piece_classes = {"K": King, "R": Rook, "B": Bishop}
+    squares = rng.sample(range(size * size), len(slots))
+    B = (size, PieceList([piece_classes[letter](square % size + 1, square // size + 1, side)
+                          for (letter, side), square in zip(slots, squares)]))
+    return None if is_check(False, B) else B
+
+def mate_length(B : Board, n : int) -> Optional[int]:
+    '''returns the number of White moves of the shortest forced mate on B, if it is at most n, None otherwise'''
+    line = solve_mate(B, n)
+    return None if line is None else (len(line) + 1) // 2
+
+def _run_batch(batch : Batch) -> tuple[int, list[tuple[Position, int]]]:
+    '''worker: samples one batch and returns the number of legal boards sampled and the puzzles found with their mate lengths'''
+    size, signature, n, exact, seed, number, samples = batch
+    rng = Random(f"{seed}:{number}")
+    slots = parse_signature(signature)
+    legal = 0
+    puzzles = []
+    for _ in range(samples):
+        B = sample_board(size, slots, rng)
+        if B is None:
+            continue
+        legal += 1
+        moves = mate_length(B, n)
+        if moves is not None and (moves == n or not exact):
+            puzzles.append((Position.from_board(B, True), moves))
+    return legal, puzzles
+
+def iter_batches(size : int, signature : str, n : int, exact : bool, seed : int, workers : int,
+                 batch_size : int) -> Iterator[tuple[int, list[tuple[Position, int]]]]:
+    '''yields the results of batch after batch, in batch order, with at most a few batches per worker in flight'''
+    batches = ((size, signature, n, exact, seed, number, batch_size) for number in range(2**62))
+    if workers <= 1:
+        yield from map(_run_batch, batches)
+        return
+    with ProcessPoolExecutor(workers) as pool:
+        pending : deque[Future] = deque()
+        try:
+            for batch in batches:
+                pending.append(pool.submit(_run_batch, batch))
+                if len(pending) >= 2 * workers:
+                    yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+def generate_puzzles(size : int, signature : str, n : int, count : int, directory : str = ".", exact : bool = False,
+                     seed : int = 0, workers : int = 1, batch_size : int = 64,
+                     max_samples : Optional[int] = MAX_SAMPLES) -> dict[str, Any]:
+    '''
+    generates count puzzles of the given board size and material signature (see chess_tablebase.parse_signature) where White
+    to move forces mate within n moves (in exactly n moves when exact), saving each new one with save_board to directory as
+    puzzle_k.txt as soon as it is found; stops early after max_samples samples (never if None)
+    raises ValueError if the signature is not valid or its pieces do not fit on the board
+    returns the numbers of samples, legal boards, puzzles and duplicates, the acceptance rate and the puzzles per second
+    '''
+    slots = parse_signature(signature) # rejects invalid signatures before starting the workers
+    if len(slots) > size * size:
+        raise ValueError(f"the {len(slots)} pieces of {signature} do not fit on a {size}x{size} board")
+    os.makedirs(directory, exist_ok=True)
+    seen : set[Position] = set()
+    samples = legal = duplicates = 0
+    mate_lengths : dict[int, int] = {}
+    start = time.perf_counter()
+    for batch_legal, puzzles in iter_batches(size, signature, n, exact, seed, workers, batch_size):
+        samples += batch_size
+        legal += batch_legal
+        for position, moves in puzzles:
+            if len(seen) >= count:
+                break
+            if position in seen:
+                duplicates += 1
+                continue
+            seen.add(position)
+            mate_lengths[moves] = mate_lengths.get(moves, 0) + 1
+            save_board(os.path.join(directory, f"puzzle_{len(seen)}.txt"), position.to_board())
+        if len(seen) >= count or (max_samples is not None and samples >= max_samples):
+            break
+    elapsed = time.perf_counter() - start
+    return {
+        "puzzles": len(seen),
+        "samples": samples,
+        "legal_samples": legal,
+        "duplicates": duplicates,
+        "acceptance_rate": len(seen) / legal if legal else 0.0,
+        "mate_lengths": {str(moves): found for moves, found in sorted(mate_lengths.items())},
+        "seconds": elapsed,
+        "puzzles_per_second": len(seen) / elapsed if elapsed > 0 else 0.0,
+    }
+
+def main(argv : Optional[Sequence[str]] = None) -> None:
+    ''' generates mate puzzles and prints the run statistics as JSON '''
+    parser = argparse.ArgumentParser(description="Generate forced-mate puzzles for White of a board size and material.")
+    parser.add_argument("size", type=int, help="board size")
+    parser.add_argument("signature", help="material signature, e.g. KRvK or KRBvKB")
+    parser.add_argument("n", type=int, help="maximum number of White moves of the mate")
+    parser.add_argument("count", type=int, help="number of puzzles to generate")
+    parser.add_argument("--directory", default="puzzles", help="directory to save the puzzles to")
+    parser.add_argument("--exact", action="store_true", help="only keep puzzles whose shortest mate takes exactly n moves")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the sampling")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="number of worker processes")
+    parser.add_argument("--batch-size", type=int, default=64, help="samples per batch sent to a worker")
+    parser.add_argument("--max-samples", type=int, default=MAX_SAMPLES, help="give up after this many samples")
+    args = parser.parse_args(argv)
+    summary = generate_puzzles(args.size, args.signature, args.n, args.count, args.directory, args.exact, args.seed,
+                               args.workers, args.batch_size, args.max_samples)
+    print(json.dumps(summary, indent=2))
+
+if __name__ == '__main__':
+    main()
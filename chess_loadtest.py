@@ -0,0 +1,93 @@
+import argparse
+import asyncio
+import json
+import time
+from random import Random
+from typing import Any, Optional, Sequence
+
+from chess_puzzle_final import (generate_legal_moves, index2location, location2index, make_move, parse_board, piece_at,
+                                split_player_move)
+
+# Load-test client of chess_server: N concurrent sessions each load a board and play random White moves,
+# following Black's replies on a local copy of the board, while the latency of every request is recorded
+
+def percentile(values : Sequence[float], fraction : float) -> float:
+    '''returns the nearest-rank percentile of values at fraction (0.5 for the median)'''
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, int(fraction * len(ordered) + 0.5) - 1))]
+
+async def request(reader : asyncio.StreamReader, writer : asyncio.StreamWriter, lines : Sequence[str]) -> list[str]:
+    '''sends the lines of one request and returns the lines of its response, raising IOError on ERR'''
+    writer.write(("\n".join(lines) + "\n").encode())
+    await writer.drain()
+    status = (await reader.readline()).decode().strip()
+    if not status.startswith("OK "):
+        raise IOError(status)
+    return [(await reader.readline()).decode().rstrip("\n") for _ in range(int(status[3:]))]
+
+async def session(host : str, port : int, board_lines : Sequence[str], max_moves : int, seed : int,
+                  latencies : list[float]) -> None:
+    '''plays one session of at most max_moves White moves, appending the latency of every request to latencies'''
+    rng = Random(seed)
+    B = parse_board(board_lines)
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        start = time.perf_counter()
+        await request(reader, writer, ["LOAD", *[line.rstrip("\r\n") for line in board_lines]])
+        latencies.append(time.perf_counter() - start)
+        for _ in range(max_moves):
+            moves = list(generate_legal_moves(True, B))
+            if not moves:
+                break
+            piece, x, y = rng.choice(moves)
+            move_string = index2location(piece.pos_x, piece.pos_y) + index2location(x, y)
+            start = time.perf_counter()
+            lines = await request(reader, writer, [f"MOVE {move_string}"])
+            latencies.append(time.perf_counter() - start)
+            make_move(piece, x, y, B)
+            if lines[0].startswith("BLACK "):
+                start_loc, end_loc = split_player_move(lines[0][6:])
+                from_x, from_y = location2index(start_loc)
+                to_x, to_y = location2index(end_loc)
+                make_move(piece_at(from_x, from_y, B), to_x, to_y, B)
+            if any(line.startswith("RESULT ") for line in lines[:2]):
+                break
+        await request(reader, writer, ["QUIT"])
+    finally:
+        writer.close()
+
+async def load_test(host : str, port : int, board_lines : Sequence[str], sessions : int, max_moves : int = 20,
+                    seed : int = 0) -> dict[str, Any]:
+    '''runs sessions concurrent sessions and returns the number of requests, their rate and latency percentiles in milliseconds'''
+    latencies : list[float] = []
+    start = time.perf_counter()
+    await asyncio.gather(*(session(host, port, board_lines, max_moves, seed + i, latencies) for i in range(sessions)))
+    elapsed = time.perf_counter() - start
+    return {
+        "sessions": sessions,
+        "requests": len(latencies),
+        "requests_per_second": len(latencies) / elapsed if elapsed > 0 else 0.0,
+        "p50_ms": 1000 * percentile(latencies, 0.5),
+        "p90_ms": 1000 * percentile(latencies, 0.9),
+        "p99_ms": 1000 * percentile(latencies, 0.99),
+        "max_ms": 1000 * max(latencies, default=0.0),
+    }
+
+def main(argv : Optional[Sequence[str]] = None) -> None:
+    ''' load-tests a running chess_server with concurrent sessions playing from a plain board file '''
+    parser = argparse.ArgumentParser(description="Load-test a chess_server with concurrent play sessions.")
+    parser.add_argument("filename", help="plain board configuration file every session starts from")
+    parser.add_argument("--host", default="127.0.0.1", help="server address")
+    parser.add_argument("--port", type=int, default=8765, help="server port")
+    parser.add_argument("--sessions", type=int, default=50, help="number of concurrent sessions")
+    parser.add_argument("--moves", type=int, default=20, help="maximum number of White moves per session")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random White moves")
+    args = parser.parse_args(argv)
+    with open(args.filename) as plain_board:
+        board_lines = plain_board.readlines()[:3]
+    print(json.dumps(asyncio.run(load_test(args.host, args.port, board_lines, args.sessions, args.moves, args.seed)), indent=2))
+
+if __name__ == '__main__':
+    main()
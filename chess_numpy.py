@@ -0,0 +1,160 @@
+from functools import lru_cache
+from typing import Sequence
+
+import numpy as np
+
+from chess_puzzle_final import GEOMETRY_CACHE_SIZE, POSITION_CODES, Board
+
+# Batch analysis with NumPy: N boards of one size are held as an (N, S, S) int8 tensor, T[n, y-1, x-1] being 0 for an
+# empty square or the index + 1 of its piece in POSITION_CODES (as in Position)
+# Attack masks are computed for all N boards at once by shifting whole (N, S, S) boolean arrays along the rays;
+# check and move generation read the squares along the rays of one square per board through a precomputed ray table
+
+ROOK_DIRECTIONS = ((0, 1), (0, -1), (-1, 0), (1, 0))
+BISHOP_DIRECTIONS = ((-1, 1), (1, 1), (-1, -1), (1, -1))
+KING_DIRECTIONS = ROOK_DIRECTIONS + BISHOP_DIRECTIONS
+
+def piece_code(letter : str, side : bool) -> int:
+    '''returns the tensor value of a piece of type letter and side'''
+    return POSITION_CODES.index((letter, side)) + 1
+
+def boards2tensor(boards : Sequence[Board]) -> np.ndarray:
+    '''
+    converts boards of one size to their (N, S, S) int8 tensor
+    raises ValueError if the boards are not all of the same size
+    '''
+    sizes = {B[0] for B in boards}
+    if len(sizes) > 1:
+        raise ValueError(f"boards of sizes {sorted(sizes)} cannot share a tensor")
+    size = sizes.pop() if sizes else 1
+    T = np.zeros((len(boards), size, size), dtype=np.int8)
+    for n, B in enumerate(boards):
+        for piece in B[1]:
+            T[n, piece.pos_y - 1, piece.pos_x - 1] = piece_code(piece.letter, piece.side)
+    return T
+
+def shift(mask : np.ndarray, dx : int, dy : int) -> np.ndarray:
+    '''returns mask moved by dx files and dy rows on every board, squares moved off the board being dropped'''
+    moved = np.zeros_like(mask)
+    size = mask.shape[-1]
+    moved[:, max(dy, 0):size + min(dy, 0), max(dx, 0):size + min(dx, 0)] = \
+        mask[:, max(-dy, 0):size + min(-dy, 0), max(-dx, 0):size + min(-dx, 0)]
+    return moved
+
+def ray_attacks(sources : np.ndarray, occupied : np.ndarray, directions : Sequence[tuple[int, int]]) -> np.ndarray:
+    '''returns the squares attacked along directions from the squares of sources, each ray stopping at the first occupied square'''
+    attacked = np.zeros_like(sources)
+    for dx, dy in directions:
+        ray = sources
+        for _ in range(sources.shape[-1] - 1):
+            ray = shift(ray, dx, dy)
+            if not ray.any():
+                break
+            attacked |= ray
+            ray = ray & ~occupied
+    return attacked
+
+def king_attacks(kings : np.ndarray) -> np.ndarray:
+    '''returns the squares next to the squares of kings'''
+    attacked = np.zeros_like(kings)
+    for dx, dy in KING_DIRECTIONS:
+        attacked |= shift(kings, dx, dy)
+    return attacked
+
+def attack_masks(T : np.ndarray, side : bool) -> np.ndarray:
+    '''returns the (N, S, S) boolean mask of the squares attacked by the pieces of side on every board of tensor T'''
+    occupied = T != 0
+    return (ray_attacks(T == piece_code("R", side), occupied, ROOK_DIRECTIONS)
+            | ray_attacks(T == piece_code("B", side), occupied, BISHOP_DIRECTIONS)
+            | king_attacks(T == piece_code("K", side)))
+
+@lru_cache(maxsize=GEOMETRY_CACHE_SIZE)
+def ray_table(size : int) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    returns, for a board of the given size, the (S*S, 8, L) array of the squares (y-1)*S + (x-1) met along each of the
+    KING_DIRECTIONS from every square, nearest first, L being S - 1, and the mask of the entries that are on the board
+    '''
+    length = max(size - 1, 1)
+    squares = np.zeros((size * size, len(KING_DIRECTIONS), length), dtype=np.intp)
+    on_board = np.zeros(squares.shape, dtype=bool)
+    for square in range(size * size):
+        for d, (dx, dy) in enumerate(KING_DIRECTIONS):
+            x, y = square % size + dx, square // size + dy
+            for step in range(length):
+                if not (0 <= x < size and 0 <= y < size):
+                    break
+                squares[square, d, step], on_board[square, d, step] = y * size + x, True
+                x, y = x + dx, y + dy
+    return squares, on_board
+
+@lru_cache(maxsize=GEOMETRY_CACHE_SIZE)
+def move_shapes(size : int) -> np.ndarray:
+    '''returns the (3, 8, L) mask of the ray entries a king, a rook and a bishop may move along, in that order'''
+    length = max(size - 1, 1)
+    shapes = np.zeros((3, len(KING_DIRECTIONS), length), dtype=bool)
+    shapes[0, :, 0] = True
+    shapes[1, :len(ROOK_DIRECTIONS), :] = True
+    shapes[2, len(ROOK_DIRECTIONS):, :] = True
+    return shapes
+
+def ray_values(flat : np.ndarray, size : int, squares : np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    returns the tensor values met along the 8 rays from squares[k] on the flattened board flat[k] of the given size,
+    as a (K, 8, L) array (0 past the board edge), and the mask of the entries on the board
+    '''
+    table, on_board = ray_table(size)
+    values = flat[np.arange(len(flat))[:, None, None], table[squares]]
+    mask = on_board[squares]
+    return np.where(mask, values, 0), mask
+
+def is_check_batch(T : np.ndarray, side : bool) -> np.ndarray:
+    '''
+    returns the (N,) boolean array telling, for every board of tensor T, if it is check for side (see is_check)
+    the rays are cast from the king of side to their first blocker, as is_check does
+    '''
+    return _is_check_flat(T.reshape(len(T), -1), T.shape[-1], side)
+
+def _is_check_flat(flat : np.ndarray, size : int, side : bool) -> np.ndarray:
+    '''is_check_batch of flattened boards'''
+    kings = np.argmax(flat == piece_code("K", side), axis=1)
+    values, _ = ray_values(flat, size, kings)
+    first = np.take_along_axis(values, np.argmax(values != 0, axis=2)[:, :, None], axis=2)[:, :, 0] # first blocker
+    rook_rays = len(ROOK_DIRECTIONS)
+    return ((first[:, :rook_rays] == piece_code("R", not side)).any(axis=1)
+            | (first[:, rook_rays:] == piece_code("B", not side)).any(axis=1)
+            | (values[:, :, 0] == piece_code("K", not side)).any(axis=1))
+
+def legal_move_counts(T : np.ndarray, side : bool, chunk : int = 256) -> np.ndarray:
+    '''
+    returns the (N,) array of the number of legal moves of side on every board of tensor T (see generate_legal_moves)
+    the squares every piece of side can reach are read off its rays at once, then every such move is played on its own
+    copy of its board and those copies are tested for check all together; boards go chunk at a time
+    '''
+    flat = T.reshape(len(T), -1)
+    counts = np.zeros(len(T), dtype=np.int64)
+    for start in range(0, len(T), chunk):
+        counts[start:start + chunk] = _legal_move_counts(flat[start:start + chunk], T.shape[-1], side)
+    return counts
+
+def _legal_move_counts(flat : np.ndarray, size : int, side : bool) -> np.ndarray:
+    '''legal_move_counts of one chunk of flattened boards'''
+    own_codes = [piece_code(letter, side) for letter in ("K", "R", "B")]
+    boards, squares = np.nonzero(np.isin(flat, own_codes))
+    codes = flat[boards, squares]
+    values, on_board = ray_values(flat[boards], size, squares)
+    occupied = values != 0
+    open_before = np.cumsum(occupied, axis=2) - occupied == 0 # nothing stands between the piece and the square
+    reach = on_board & open_before & ~np.isin(values, own_codes)
+    reach &= move_shapes(size)[codes - own_codes[0]] # the codes of a side run king, rook, bishop
+    movers, directions, steps = np.nonzero(reach)
+    targets = ray_table(size)[0][squares[movers], directions, steps]
+    children = flat[boards[movers]].copy()
+    moves = np.arange(len(movers))
+    children[moves, squares[movers]] = 0
+    children[moves, targets] = codes[movers]
+    legal = ~_is_check_flat(children, size, side)
+    return np.bincount(boards[movers][legal], minlength=len(flat))
+
+def is_checkmate_batch(T : np.ndarray, side : bool, chunk : int = 256) -> np.ndarray:
+    '''returns the (N,) boolean array telling, for every board of tensor T, if it is checkmate for side (see is_checkmate)'''
+    return legal_move_counts(T, side, chunk) == 0
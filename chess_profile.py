@@ -0,0 +1,163 @@
+import json
+import time
+from typing import Any, Callable, Optional
+
+import chess_puzzle_final
+
+# Opt-in profiling of the hot functions of chess_puzzle_final: enable() swaps them for wrappers that count calls and
+# accumulate wall time (inclusive of the calls they make), disable() puts the originals back, so nothing is paid while off
+# Only calls made through chess_puzzle_final are seen: modules that imported a function by name keep the original
+
+PROFILE_ENV = "CHESS_PROFILE" # "table" or "json" to profile the play of main() and print the summary at its end
+FORMATS = ("table", "json")
+
+HOT_FUNCTIONS = ("find_black_move", "is_checkmate", "generate_legal_moves", "is_check", "is_legal_by_trial", "is_safe_move",
+                 "make_move", "unmake_move")
+HOT_METHODS = ("can_move_to", "can_reach") # wrapped on every piece class defining them
+GENERATORS = ("generate_legal_moves",) # timed across their steps, and the items they yield counted
+
+LEGALITY_CHECKS = ("is_legal_by_trial", "is_safe_move") # the two ways generate_legal_moves decides a candidate move
+
+# measure name -> (function measured per call, counters whose summed increase during the call is recorded, kind of counter)
+# the nodes of is_checkmate and analyse are the candidate moves whose legality they had checked
+MEASURES = {
+    "find_black_move candidates": ("find_black_move", ("generate_legal_moves",), "items"),
+    "is_checkmate nodes": ("is_checkmate", LEGALITY_CHECKS, "calls"),
+    "analyse nodes": ("analyse", LEGALITY_CHECKS, "calls"), # AnalysisCache.analyse, which decides checkmate when a cache is set
+}
+
+class Profiler:
+    '''call counts, inclusive wall times and measures of the profiled functions, in total and per move'''
+
+    def __init__(self):
+        self.calls : dict[str, int] = {}
+        self.seconds : dict[str, float] = {}
+        self.items : dict[str, int] = {}
+        self.samples : dict[str, list[int]] = {name: [] for name in MEASURES}
+        self.moves : list[dict[str, Any]] = []
+        self._mark = self._snapshot()
+
+    def _snapshot(self) -> tuple[dict[str, int], dict[str, float], dict[str, int], float]:
+        return (dict(self.calls), dict(self.seconds), {name: len(values) for name, values in self.samples.items()},
+                time.perf_counter())
+
+    def add(self, name : str, seconds : float, items : int = 0) -> None:
+        '''records one call of name taking seconds and yielding items'''
+        self.calls[name] = self.calls.get(name, 0) + 1
+        self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+        if items:
+            self.items[name] = self.items.get(name, 0) + items
+
+    def count(self, names : tuple[str, ...], kind : str) -> int:
+        '''returns the calls (kind "calls") or yielded items (kind "items") of the functions names, summed'''
+        counter = getattr(self, kind)
+        return sum(counter.get(name, 0) for name in names)
+
+    def end_move(self, label : str) -> None:
+        '''closes the summary of the move named label: what was called since the previous move ended'''
+        calls, seconds, samples, start = self._mark
+        self._mark = self._snapshot()
+        move : dict[str, Any] = {"move": label, "seconds": self._mark[3] - start, "functions": {}}
+        for name in self.calls:
+            if self.calls[name] > calls.get(name, 0):
+                move["functions"][name] = {"calls": self.calls[name] - calls.get(name, 0),
+                                           "seconds": self.seconds[name] - seconds.get(name, 0.0)}
+        for name, values in self.samples.items():
+            if len(values) > samples[name]:
+                move[name] = sum(values[samples[name]:])
+        self.moves.append(move)
+
+    def summary(self) -> dict[str, Any]:
+        '''returns the totals of every profiled function and measure, and the per-move summaries, ready for JSON'''
+        functions = {name: {"calls": self.calls[name], "seconds": self.seconds[name],
+                            "microseconds_per_call": 1e6 * self.seconds[name] / self.calls[name]}
+                     for name in sorted(self.calls, key=self.seconds.__getitem__, reverse=True)}
+        for name, items in self.items.items():
+            functions[name]["items"] = items
+        measures = {name: {"count": len(values), "total": sum(values), "mean": sum(values) / len(values) if values else 0.0,
+                           "max": max(values, default=0)}
+                    for name, values in self.samples.items()}
+        return {"functions": functions, "measures": measures, "moves": self.moves}
+
+    def table(self) -> str:
+        '''returns the totals as a text table'''
+        summary = self.summary()
+        lines = [f"{'function':<24}{'calls':>12}{'seconds':>12}{'us/call':>12}"]
+        for name, stats in summary["functions"].items():
+            lines.append(f"{name:<24}{stats['calls']:>12}{stats['seconds']:>12.4f}{stats['microseconds_per_call']:>12.2f}")
+        lines.append(f"{'measure':<32}{'count':>8}{'mean':>10}{'max':>8}")
+        for name, stats in summary["measures"].items():
+            lines.append(f"{name:<32}{stats['count']:>8}{stats['mean']:>10.1f}{stats['max']:>8}")
+        lines.append(f"{len(self.moves)} moves")
+        return "\n".join(lines)
+
+    def report(self, output_format : str) -> str:
+        '''returns the summary in output_format, "table" or "json"'''
+        return self.table() if output_format == "table" else json.dumps(self.summary(), indent=2)
+
+_profiler : Optional[Profiler] = None
+_originals : list[tuple[Any, str, Any]] = [] # (owner, attribute, original) of every wrapped function
+
+def _wrap(function : Callable, name : str, profiler : Profiler) -> Callable:
+    '''returns the counting, timing wrapper of function, recording under name'''
+    measures = [(measure, counters, kind) for measure, (measured, counters, kind) in MEASURES.items() if measured == name]
+    if name in GENERATORS:
+        def generator_wrapper(*args : Any, **kwargs : Any) -> Any:
+            seconds, items = 0.0, 0
+            generator = function(*args, **kwargs)
+            try:
+                while True:
+                    start = time.perf_counter()
+                    try:
+                        item = next(generator)
+                    except StopIteration:
+                        return
+                    finally:
+                        seconds += time.perf_counter() - start
+                    items += 1
+                    yield item
+            finally:
+                profiler.add(name, seconds, items)
+        return generator_wrapper
+
+    def wrapper(*args : Any, **kwargs : Any) -> Any:
+        before = [profiler.count(counters, kind) for _, counters, kind in measures]
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            profiler.add(name, time.perf_counter() - start)
+            for (measure, counters, kind), count in zip(measures, before):
+                profiler.samples[measure].append(profiler.count(counters, kind) - count)
+    return wrapper
+
+def enable(profiler : Optional[Profiler] = None) -> Profiler:
+    '''starts profiling into profiler (a new one by default) and returns it; profiling already on is restarted'''
+    global _profiler
+    disable()
+    _profiler = profiler if profiler is not None else Profiler()
+    for name in HOT_FUNCTIONS:
+        _originals.append((chess_puzzle_final, name, getattr(chess_puzzle_final, name)))
+        setattr(chess_puzzle_final, name, _wrap(getattr(chess_puzzle_final, name), name, _profiler))
+    for piece_class in (chess_puzzle_final.Piece, chess_puzzle_final.Rook, chess_puzzle_final.Bishop, chess_puzzle_final.King):
+        for name in HOT_METHODS:
+            if name in piece_class.__dict__:
+                _originals.append((piece_class, name, piece_class.__dict__[name]))
+                setattr(piece_class, name, _wrap(piece_class.__dict__[name], name, _profiler))
+    analyse = chess_puzzle_final.AnalysisCache.analyse
+    _originals.append((chess_puzzle_final.AnalysisCache, "analyse", analyse))
+    chess_puzzle_final.AnalysisCache.analyse = _wrap(analyse, "analyse", _profiler)
+    return _profiler
+
+def disable() -> Optional[Profiler]:
+    '''stops profiling, restoring the original functions, and returns the profiler that was in use'''
+    global _profiler
+    while _originals:
+        owner, name, original = _originals.pop()
+        setattr(owner, name, original)
+    profiler, _profiler = _profiler, None
+    return profiler
+
+def profiler() -> Optional[Profiler]:
+    '''returns the profiler in use, None when profiling is off'''
+    return _profiler
@@ -1,6 +1,9 @@
-import copy
+import mmap
+import os
+from collections import OrderedDict
+from functools import lru_cache
 from random import randrange, choice
-from typing import Any, List, Tuple, Union, Sequence
+from typing import Any, AnyStr, Iterable, Iterator, List, Optional, Tuple, Sequence
 
 def location2index(loc: str) -> tuple[int, int]:
     '''converts chess location to corresponding x and y coordinates'''
@@ -14,62 +17,85 @@ def index2location(x: int, y: int) -> str:
 Board = tuple[int, list['Piece']]
 
 class Piece: #Base class for pieces
+    __slots__ = ("pos_x", "pos_y", "side") # no per-instance __dict__
     pos_x : int
     pos_y : int
     side : bool #True for White and False for Black
-    piece_code : Union[list[str], str]
+    letter : str = "" # letter of the piece in the plain board format, set by subclasses
+    piece_codes : tuple[str, str] = ("", "") # unicode sequences for the white and black piece, set by subclasses
     
     def __init__(self, pos_X : int, pos_Y : int, side_ : bool):
         '''sets initial values'''
         self.pos_x = pos_X
         self.pos_y = pos_Y
         self.side = side_
-        piece_code = ["\u2656", "\u265C", "\u2657", "\u265D", "\u2654", "\u265A"] # full list of piece codes to be narrowed down by subclasses
 
-    def _get_move_list(self, pos_X: int, pos_Y: int) -> list[tuple[int, int]]:
+    @property
+    def piece_code(self) -> str:
+        '''unicode sequence of this piece, determined by its side'''
+        return self.piece_codes[0] if self.side else self.piece_codes[1]
+
+    directions : tuple[tuple[int, int], ...] = () # ray directions walked by sliding pieces, set by subclasses
+
+    def _get_move_list(self, pos_X: int, pos_Y: int, B : Board) -> Sequence[tuple[int, int]]:
+        '''
+        gets the squares from this piece up to and including pos_X, pos_Y along the one of its rays leading there,
+        or an empty list if pos_X, pos_Y is on none of its rays
+        '''
+        dx, dy = pos_X - self.pos_x, pos_Y - self.pos_y
+        distance = max(abs(dx), abs(dy))
+        if distance == 0:
+            return []
+        direction = (dx // distance, dy // distance)
+        if direction not in self.directions or (direction[0] * distance, direction[1] * distance) != (dx, dy):
+            return []
+        return geometry(B[0]).rays[direction][(self.pos_x, self.pos_y)][:distance]
+
+    def attacked_squares(self, B : Board) -> Iterator[tuple[int, int]]:
         '''
-        abstract method for obtaining the move_list
+        yields every square this Rook or Bishop piece attacks on board B
+        by walking each of its rays up to and including the first blocking piece of either side
         '''
-        pass
+        rays = geometry(B[0]).rays
+        for direction in self.directions:
+            for x, y in rays[direction][(self.pos_x, self.pos_y)]:
+                yield (x, y)
+                if is_piece_at(x, y, B):
+                    break
+
+    def reachable_squares(self, B : Board) -> Iterator[tuple[int, int]]:
+        '''yields every square this piece can reach on board B (see can_reach)'''
+        for x, y in self.attacked_squares(B):
+            if not is_piece_at(x, y, B) or piece_at(x, y, B).side != self.side:
+                yield (x, y)
 
     def can_reach(self, pos_X : int, pos_Y : int, B : Board) -> bool:
         '''
         checks if this Rook or Bishop piece can move to coordinates pos_X, pos_Y
         on board B according to rule ([Rule1] or [Rule2]) and [Rule4](see section Intro)
         '''
-        squares = get_squares(B)
-        if (pos_X, pos_Y) in self._get_move_list(pos_X, pos_Y) and (pos_X, pos_Y) in squares:
-            for pos in self._get_move_list(pos_X, pos_Y):
-                if not is_piece_at(pos[0], pos[1], B):
-                    continue
-                elif is_piece_at(pos[0], pos[1], B):
-                    if pos == (pos_X, pos_Y) and piece_at(pos_X, pos_Y, B).side != self.side:
-                        return True
-                    else:
-                        return False
-            return True
-        else:
+        if (pos_X, pos_Y) not in geometry(B[0]).square_set:
             return False
+        move_list = self._get_move_list(pos_X, pos_Y, B)
+        if not move_list:
+            return False
+        for pos in move_list[:-1]:
+            if is_piece_at(pos[0], pos[1], B):
+                return False
+        return not is_piece_at(pos_X, pos_Y, B) or piece_at(pos_X, pos_Y, B).side != self.side
 
     def can_move_to(self, pos_X : int, pos_Y : int, B : Board) -> bool:
         '''
         checks if this piece can move to coordinates pos_X, pos_Y
         on board B according to all chess rules
         '''
-        temp_B = copy.deepcopy(B)
-        moving_piece = copy.deepcopy(self)
-        if self.can_reach(pos_X, pos_Y, B):
-            if is_piece_at(pos_X, pos_Y, B) and piece_at(pos_X, pos_Y, B).side != self.side:
-                temp_B[1].remove(piece_at(pos_X, pos_Y, temp_B))
-            temp_B[1].remove(piece_at(self.pos_x, self.pos_y, temp_B))
-            moving_piece.pos_x, moving_piece.pos_y = pos_X, pos_Y
-            temp_B[1].append(moving_piece)
-            if is_check(moving_piece.side, temp_B):
-                return False
-            else:
-                return True
-        else:
+        if _engine is not None:
+            return _engine.can_move_to(self, pos_X, pos_Y, B)
+        if not self.can_reach(pos_X, pos_Y, B):
             return False
+        if isinstance(self, King):
+            return is_legal_by_trial(self, pos_X, pos_Y, B)
+        return is_safe_move(self, pos_X, pos_Y, king_safety(self.side, B))
    
     def move_to(self, pos_X : int, pos_Y : int, B : Board) -> Board:
         '''
@@ -77,15 +103,169 @@ class Piece: #Base class for pieces
         assumes this move is valid according to chess rules
         '''
         if self.can_move_to(pos_X, pos_Y, B):
-            if is_piece_at(pos_X, pos_Y, B) and piece_at(pos_X, pos_Y, B).side != self.side:
-                B[1].remove(piece_at(pos_X, pos_Y, B))
-            self.pos_x, self.pos_y = pos_X, pos_Y
+            make_move(self, pos_X, pos_Y, B)
+        return B
+
+# Square-indexed piece list used as the piece list of a Board
+
+class PieceList(list):
+    '''
+    list of pieces that also keeps a square -> piece index in sync with its contents,
+    so occupancy lookups on a board built from it take O(1) instead of a scan of every piece
+    pieces must change square through relocate (or move_to) to keep the index valid
+    '''
+    by_square : dict[tuple[int, int], Piece]
+    attack_map : Optional['AttackMap'] # kept up to date by make_move / unmake_move when set (see track_attacks)
+
+    def __init__(self, pieces : Sequence[Piece] = ()):
+        super().__init__(pieces)
+        self.by_square = {(piece.pos_x, piece.pos_y): piece for piece in self}
+        self.attack_map = None
+
+    def append(self, piece : Piece) -> None:
+        super().append(piece)
+        self.by_square[(piece.pos_x, piece.pos_y)] = piece
+
+    def insert(self, i : Any, piece : Piece) -> None:
+        super().insert(i, piece)
+        self.by_square[(piece.pos_x, piece.pos_y)] = piece
+
+    def extend(self, pieces : Sequence[Piece]) -> None:
+        for piece in pieces:
+            self.append(piece)
+
+    def remove(self, piece : Piece) -> None:
+        super().remove(piece)
+        self._unindex(piece)
+
+    def pop(self, i : Any = -1) -> Piece:
+        piece = super().pop(i)
+        self._unindex(piece)
+        return piece
+
+    def _unindex(self, piece : Piece) -> None:
+        '''drops piece from the index if it is the piece indexed at its square'''
+        square = (piece.pos_x, piece.pos_y)
+        if self.by_square.get(square) is piece:
+            del self.by_square[square]
+
+def relocate(piece : Piece, pos_X : int, pos_Y : int, B : Board) -> None:
+    '''moves piece to coordinates pos_X, pos_Y keeping the square index of board B up to date'''
+    if isinstance(B[1], PieceList):
+        B[1]._unindex(piece)
+        piece.pos_x, piece.pos_y = pos_X, pos_Y
+        B[1].by_square[(pos_X, pos_Y)] = piece
+    else:
+        piece.pos_x, piece.pos_y = pos_X, pos_Y
+
+def indexed_board(B : Board) -> Board:
+    '''returns board B with its pieces held in a PieceList (B itself if it already is)'''
+    if isinstance(B[1], PieceList):
         return B
+    return (B[0], PieceList(B[1]))
+
+# In-place make / unmake of moves, used for legality checks without copying the board
+
+# undo record: (moved piece, origin x, origin y, captured piece or None, list position of the captured piece)
+Undo = Tuple[Piece, int, int, Optional[Piece], int]
+
+def make_move(piece : Piece, pos_X : int, pos_Y : int, B : Board) -> Undo:
+    '''
+    moves piece to coordinates pos_X, pos_Y on board B in place, capturing any enemy piece there
+    returns the undo record needed by unmake_move to restore B exactly
+    assumes the move is reachable for piece (see can_reach)
+    '''
+    captured = None
+    captured_index = -1
+    if is_piece_at(pos_X, pos_Y, B) and piece_at(pos_X, pos_Y, B).side != piece.side:
+        captured = piece_at(pos_X, pos_Y, B)
+        captured_index = B[1].index(captured)
+        B[1].pop(captured_index)
+    undo = (piece, piece.pos_x, piece.pos_y, captured, captured_index)
+    relocate(piece, pos_X, pos_Y, B)
+    attack_map = getattr(B[1], "attack_map", None)
+    if attack_map is not None:
+        attack_map.update(B, [(undo[1], undo[2]), (pos_X, pos_Y)], captured)
+    return undo
+
+def unmake_move(undo : Undo, B : Board) -> None:
+    '''takes back the move recorded in undo on board B, restoring any captured piece to its place in the piece list'''
+    piece, from_x, from_y, captured, captured_index = undo
+    to_square = (piece.pos_x, piece.pos_y)
+    relocate(piece, from_x, from_y, B)
+    if captured is not None:
+        B[1].insert(captured_index, captured)
+    attack_map = getattr(B[1], "attack_map", None)
+    if attack_map is not None:
+        attack_map.update(B, [(from_x, from_y), to_square])
+
+# Incrementally updated attack maps
+
+class AttackMap:
+    '''
+    squares attacked by the pieces of a board, refreshed incrementally after each move
+    only the moved piece, a captured piece and the pieces attacking the vacated or entered squares are recomputed
+    '''
+    attackers : dict[tuple[int, int], set[Piece]] # square -> pieces attacking it
+    targets : dict[Piece, list[tuple[int, int]]] # piece -> squares it attacks
+    kings : dict[bool, Piece]
+
+    def __init__(self, B : Board):
+        '''builds the attack map of every piece of board B'''
+        self.attackers = {}
+        self.targets = {}
+        self.kings = {piece.side: piece for piece in B[1] if isinstance(piece, King)}
+        for piece in B[1]:
+            self._add(piece, B)
+
+    def _add(self, piece : Piece, B : Board) -> None:
+        squares = list(piece.attacked_squares(B))
+        self.targets[piece] = squares
+        for square in squares:
+            self.attackers.setdefault(square, set()).add(piece)
+
+    def _drop(self, piece : Piece) -> None:
+        for square in self.targets.pop(piece, ()):
+            self.attackers[square].discard(piece)
+
+    def update(self, B : Board, squares : list[tuple[int, int]], captured : Optional[Piece] = None) -> None:
+        '''refreshes the attacks changed by pieces leaving or entering squares, dropping captured if given'''
+        if captured is not None:
+            self._drop(captured)
+        affected = set()
+        for square in squares:
+            affected |= self.attackers.get(square, set())
+            if is_piece_at(square[0], square[1], B):
+                affected.add(piece_at(square[0], square[1], B))
+        for piece in affected:
+            self._drop(piece)
+            if piece is not captured:
+                self._add(piece, B)
+
+    def is_attacked(self, pos_X : int, pos_Y : int, side : bool) -> bool:
+        '''checks if square pos_X, pos_Y is attacked by a piece of side'''
+        return any(piece.side == side for piece in self.attackers.get((pos_X, pos_Y), ()))
+
+    def is_check(self, side : bool) -> bool:
+        '''checks if the king of side is attacked'''
+        king = self.kings[side]
+        return self.is_attacked(king.pos_x, king.pos_y, not side)
+
+def track_attacks(B : Board) -> Board:
+    '''
+    returns board B (indexed, see indexed_board) carrying an AttackMap that make_move and unmake_move keep up to date,
+    so is_check on it becomes a lookup of the king's square
+    '''
+    B = indexed_board(B)
+    B[1].attack_map = AttackMap(B)
+    return B
 
 # General functions used throughout other functions & class methods
 
 def is_piece_at(pos_X : int, pos_Y : int, B: Board) -> bool:
     '''checks if there is piece at coordinates pox_X, pos_Y of board B'''
+    if isinstance(B[1], PieceList):
+        return (pos_X, pos_Y) in B[1].by_square
     for piece in B[1]:
         if pos_X == piece.pos_x:
             if pos_Y == piece.pos_y:
@@ -97,304 +277,679 @@ def piece_at(pos_X : int, pos_Y : int, B: Board) -> Piece:
     returns the piece at coordinates pox_X, pos_Y of board B
     assumes some piece at coordinates pox_X, pos_Y of board B is present
     '''
+    if isinstance(B[1], PieceList):
+        return B[1].by_square[(pos_X, pos_Y)]
     for piece in B[1]:
         if pos_X == piece.pos_x:
             if pos_Y == piece.pos_y:
-                piece_at = piece
-    return piece_at
+                return piece
+    raise KeyError((pos_X, pos_Y))
 
 def get_squares(B: Board) -> list[tuple[int, int]]:
-    ''' returns a list of all the squares on the board '''
-    return [(x, y) for x in range(1, (B[0])+1) for y in range(1, (B[0])+1)]
+    ''' returns a list of all the squares on the board (shared between boards of the same size, so not to be modified) '''
+    return geometry(B[0]).squares
+
+# Per-board-size geometry tables, built on first use of a size and shared by every board of that size
+
+GEOMETRY_CACHE_SIZE = 8 # number of board sizes kept before the least recently used one is evicted
+
+class Geometry:
+    '''squares, rook and bishop rays and king neighbourhoods of a board of one size'''
+    size : int
+    squares : list[tuple[int, int]] # in the order of get_squares
+    square_set : frozenset[tuple[int, int]]
+    rows : list[tuple[tuple[int, int], ...]] # top row first, as in make_board_matrix
+    rays : dict[tuple[int, int], dict[tuple[int, int], tuple[tuple[int, int], ...]]] # direction -> square -> squares along the ray
+    neighbours : dict[tuple[int, int], tuple[tuple[int, int], ...]] # square -> king neighbourhood
+
+    def __init__(self, size : int):
+        '''builds every table for boards of the given size'''
+        self.size = size
+        self.squares = [(x, y) for x in range(1, size+1) for y in range(1, size+1)]
+        self.square_set = frozenset(self.squares)
+        self.rows = [tuple((x, y) for x in range(1, size+1)) for y in range(size, 0, -1)]
+        self.rays = {}
+        for dx, dy in Rook.directions + Bishop.directions:
+            self.rays[(dx, dy)] = {
+                (x, y): tuple((x + dx*i, y + dy*i) for i in range(1, size) if (x + dx*i, y + dy*i) in self.square_set)
+                for x, y in self.squares
+            }
+        self.neighbours = {
+            (x, y): tuple(ray[(x, y)][0] for ray in self.rays.values() if ray[(x, y)])
+            for x, y in self.squares
+        }
+
+@lru_cache(maxsize=GEOMETRY_CACHE_SIZE)
+def geometry(size : int) -> Geometry:
+    '''returns the geometry tables for boards of the given size'''
+    return Geometry(size)
 
 class Rook(Piece):
-    
-    def __init__(self, pos_X : int, pos_Y : int, side_ : bool):
-        '''sets initial values by calling the constructor of Piece'''
-        super().__init__(pos_X, pos_Y, side_)
-        # unicode sequences for white and black rooks
-        piece_code = ["\u2656", "\u265C"]
-        # determines which unicode sequence to use
-        if self.side:
-            self.piece_code = piece_code[0]
-        else:
-            self.piece_code = piece_code[1]
+    __slots__ = ()
+    letter = "R"
+    piece_codes = ("\u2656", "\u265C") # unicode sequences for white and black rooks
+    directions = ((0, 1), (0, -1), (-1, 0), (1, 0)) # up, down, left, right
             
     def __repr__(self):
         return f"Rook, {self.pos_x, self.pos_y, self.side}"
-    
-    def _get_move_list(self, pos_X : int, pos_Y : int) -> list[tuple[int, int]]:
-        ''' gets a list containing a list of tuples for each possible move based on the piece's movement rules'''
-        if pos_Y > self.pos_y and self.pos_x == pos_X: # up
-            return [(self.pos_x, self.pos_y+i) for i in range(1, pos_Y - self.pos_y + 1)]
-        elif pos_Y < self.pos_y and self.pos_x == pos_X: # down
-            return [(self.pos_x, self.pos_y-i) for i in range(1, self.pos_y - pos_Y + 1)]
-        elif pos_X < self.pos_x and self.pos_y == pos_Y: # left
-            return [(self.pos_x-i, self.pos_y) for i in range(1, self.pos_x - pos_X + 1)]
-        elif pos_X > self.pos_x and self.pos_y == pos_Y: # right
-            return [(self.pos_x+i, self.pos_y) for i in range(1, pos_X - self.pos_x + 1)]
-        else: # invalid move
-            return []
 
 class Bishop(Piece):
-    
-    def __init__(self, pos_X : int, pos_Y : int, side_ : bool):
-        '''sets initial values by calling the constructor of Piece'''
-        super().__init__(pos_X, pos_Y, side_)
-
-        # unicode sequences for white and black bishops
-        piece_code = ["\u2657", "\u265D"]
-        # determines which unicode sequence to use
-        if self.side:
-            self.piece_code = piece_code[0]
-        else:
-            self.piece_code = piece_code[1]
+    __slots__ = ()
+    letter = "B"
+    piece_codes = ("\u2657", "\u265D") # unicode sequences for white and black bishops
+    directions = ((-1, 1), (1, 1), (-1, -1), (1, -1)) # up & left, up & right, down & left, down & right
 
     def __repr__(self):
         return f"Bishop, {self.pos_x, self.pos_y, self.side}"
-    
-    def _get_move_list(self, pos_X : int, pos_Y : int) -> list[tuple[int, int]]:
-        ''' gets a list containing a list of tuples for each possible move based on the piece's movement rules'''
-        if abs(self.pos_x - pos_X) == abs(self.pos_y - pos_Y):
-            if pos_Y > self.pos_y and pos_X < self.pos_x: # up & left
-                return [(self.pos_x-i, self.pos_y+i) for i in range(1, abs(pos_Y - self.pos_y) + 1)]
-            elif pos_Y > self.pos_y and pos_X > self.pos_x: # up & right
-                return [(self.pos_x+i, self.pos_y+i) for i in range(1, abs(pos_Y - self.pos_y) + 1)]
-            elif pos_Y < self.pos_y and pos_X < self.pos_x: # down & left
-                return [(self.pos_x-i, self.pos_y-i) for i in range(1, abs(pos_Y - self.pos_y) + 1)]
-            elif pos_Y < self.pos_y and pos_X > self.pos_x: # down & right
-                return [(self.pos_x+i, self.pos_y-i) for i in range(1, abs(pos_Y - self.pos_y) + 1)]
-            else:
-                return []
-        else:
-            return []
 
 class King(Piece):
-    
-    def __init__(self, pos_X : int, pos_Y : int, side_ : bool):
-        '''sets initial values by calling the constructor of Piece'''
-        #inherits from class piece
-        super().__init__(pos_X, pos_Y, side_)
-        # unicode sequences for white and black kings
-        piece_code = ["\u2654", "\u265A"]
-        # determines which unicode sequence to use
-        if self.side:
-            self.piece_code = piece_code[0]
-        else:
-            self.piece_code = piece_code[1]
+    __slots__ = ()
+    letter = "K"
+    piece_codes = ("\u2654", "\u265A") # unicode sequences for white and black kings
             
     def __repr__(self):
         return f"King, {self.pos_x, self.pos_y, self.side}"
 
     def can_reach(self, pos_X : int, pos_Y : int, B: Board) -> bool:
         '''checks if this king can move to coordinates pos_X, pos_Y on board B according to rule [Rule3] and [Rule4]'''
-        squares = get_squares(B)
-        if (pos_X, pos_Y) in squares:
-            if (abs(pos_X - self.pos_x)) <= 1 and (abs(pos_Y - self.pos_y)) <= 1:
-                if not is_piece_at(pos_X, pos_Y, B):
-                    return True
-                if is_piece_at(pos_X, pos_Y, B) and piece_at(pos_X, pos_Y, B).side != self.side:
-                    return True
+        if (pos_X, pos_Y) in geometry(B[0]).neighbours[(self.pos_x, self.pos_y)]:
+            if not is_piece_at(pos_X, pos_Y, B):
+                return True
+            if piece_at(pos_X, pos_Y, B).side != self.side:
+                return True
         return False
 
+    def attacked_squares(self, B : Board) -> Iterator[tuple[int, int]]:
+        '''yields every square of this king's neighbourhood on board B'''
+        yield from geometry(B[0]).neighbours[(self.pos_x, self.pos_y)]
+
+# Engine selection: is_check, is_checkmate and can_move_to can be answered by another backend
+
+ENGINES = ("pieces", "bitboard")
+_engine : Any = None # module providing is_check / is_checkmate / can_move_to, None for the piece engine below
+
+def set_engine(name : str) -> None:
+    '''
+    selects the backend answering is_check, is_checkmate and can_move_to
+    "pieces" is the piece-by-piece engine of this module, "bitboard" the one in chess_bitboard
+    raises ValueError for any other name
+    '''
+    global _engine
+    if name == "pieces":
+        _engine = None
+    elif name == "bitboard":
+        import chess_bitboard
+        _engine = chess_bitboard
+    else:
+        raise ValueError(f"unknown engine {name!r}, expected one of {ENGINES}")
+
 # Check & checkmate functions used to inform moving pieces and the flow of play
 
 def is_check(side : bool, B : Board) -> bool:
-    ''' checks if configuration of B is check for side '''
-    pieces = B[1]
-    check_king = [piece for piece in pieces if repr(piece)[0] == "K" and piece.side == side][0]
-    for piece in pieces:
-        if piece.side != side and piece.can_reach(check_king.pos_x, check_king.pos_y, B):
-            return True
-        else:
-            continue
+    '''
+    checks if configuration of B is check for side
+    casts the rook and bishop rays from the king to the first blocker and looks at the king's neighbourhood
+    '''
+    if _engine is not None:
+        return _engine.is_check(side, B)
+    attack_map = getattr(B[1], "attack_map", None)
+    if attack_map is not None:
+        return attack_map.is_check(side)
+    check_king = [piece for piece in B[1] if isinstance(piece, King) and piece.side == side][0]
+    king_square = (check_king.pos_x, check_king.pos_y)
+    rays = geometry(B[0]).rays
+    for attacker in (Rook, Bishop):
+        for direction in attacker.directions:
+            for x, y in rays[direction][king_square]:
+                if is_piece_at(x, y, B):
+                    piece = piece_at(x, y, B)
+                    if piece.side != side and isinstance(piece, attacker):
+                        return True
+                    break
+    for x, y in check_king.attacked_squares(B):
+        if is_piece_at(x, y, B):
+            piece = piece_at(x, y, B)
+            if piece.side != side and isinstance(piece, King):
+                return True
     return False
 
-def is_checkmate(side : bool, B : Board) -> bool:
-    ''' checks if configuration of B is checkmate for side '''
-    squares = get_squares(B)
-    pieces = [piece for piece in B[1] if piece.side == side]
-    for piece in pieces:
-        for square in squares:
-            if piece.can_reach(square[0], square[1], B):
-                temp_piece = copy.deepcopy(piece)
-                temp_piece.pos_x, temp_piece.pos_y = square[0], square[1]
-                temp_B = copy.deepcopy(B)
-                temp_B[1].remove(piece_at(piece.pos_x, piece.pos_y, temp_B))
-                temp_B[1].append(temp_piece)
-                if is_piece_at(temp_piece.pos_x, temp_piece.pos_y, temp_B) and piece_at(temp_piece.pos_x, temp_piece.pos_y, temp_B).side != temp_piece.side:
-                    temp_B[1].remove(piece_at(temp_piece.pos_x, temp_piece.pos_y, temp_B))
-                if not is_check(side, temp_B):
-                    return False
-    return True
+# Pins and checks: which moves of the pieces other than the king leave their king out of check, without trying them
 
-# Board reading & saving functions and associated functions
+Safety = tuple[dict[Piece, set[tuple[int, int]]], list[Piece], set[tuple[int, int]]]
 
-def clean_it(line : str) -> list[str]:
+def king_safety(side : bool, B : Board) -> Safety:
     '''
-    Takes a line from the board, cleans it of any unwanted characters and returns a list
+    returns, for the king of side on B: the pinned pieces of side, each with the squares of its pin ray (up to and including
+    the pinning piece) it may still move to, the pieces giving check, and the squares of their check rays (up to and including
+    the checking piece), on which a single check can be answered by a capture or a block
+    casts the rook and bishop rays from the king as is_check does
     '''
-    split_line = line.split(", ")
-    cleaned_line = []
-    for item in split_line:
-        item = item.replace("\n","")
-        item = item.replace(" ","")
-        item = item.replace(",","")
-        cleaned_line.append(item)   
-    return cleaned_line
+    king = [piece for piece in B[1] if isinstance(piece, King) and piece.side == side][0]
+    king_square = (king.pos_x, king.pos_y)
+    table = geometry(B[0])
+    board = B[1].by_square if isinstance(B[1], PieceList) else {(piece.pos_x, piece.pos_y): piece for piece in B[1]}
+    pins : dict[Piece, set[tuple[int, int]]] = {}
+    checkers : list[Piece] = []
+    check_squares : set[tuple[int, int]] = set()
+    for attacker in (Rook, Bishop):
+        for direction in attacker.directions:
+            ray = table.rays[direction][king_square]
+            shield = None # first piece of side met on the ray
+            for i, square in enumerate(ray):
+                piece = board.get(square)
+                if piece is None:
+                    continue
+                if piece.side == side:
+                    if shield is None:
+                        shield = piece
+                        continue
+                elif isinstance(piece, attacker):
+                    if shield is None:
+                        checkers.append(piece)
+                        check_squares.update(ray[:i + 1])
+                    else:
+                        pins[shield] = set(ray[:i + 1])
+                break
+    for square in table.neighbours[king_square]:
+        piece = board.get(square)
+        if piece is not None and piece.side != side and isinstance(piece, King):
+            checkers.append(piece)
+            check_squares.add(square)
+    return (pins, checkers, check_squares)
 
-def str2pieces_white(piece_str : list[str]) -> Sequence[Piece]:
+def is_safe_move(piece : Piece, pos_X : int, pos_Y : int, safety : Safety) -> bool:
     '''
-    Takes a clean string and returns the corresponding Piece item for white pieces
+    checks if the move of piece, other than a king, to coordinates pos_X, pos_Y leaves its king out of check,
+    given the king_safety of its side; assumes the piece can reach pos_X, pos_Y
     '''
-    white_king_str = [piece for piece in piece_str if piece[0] == "K"]
-    white_king = [King(location2index(piece[1:])[0], location2index(piece[1:])[1], True) for piece in white_king_str]
-    if len(white_king) != 1:
-        raise IOError 
-    white_rook_str = [piece for piece in piece_str if piece[0] == "R"]
-    white_rooks = [Rook(location2index(piece[1:])[0], location2index(piece[1:])[1], True) for piece in white_rook_str]   
-    white_bishop_str = [piece for piece in piece_str if piece[0] == "B"]
-    white_bishops = [Bishop(location2index(piece[1:])[0], location2index(piece[1:])[1], True) for piece in white_bishop_str]
-    white_pieces = white_king + white_rooks + white_bishops
-    return white_pieces
+    pins, checkers, check_squares = safety
+    if len(checkers) > 1 or (checkers and (pos_X, pos_Y) not in check_squares):
+        return False
+    pin = pins.get(piece)
+    return pin is None or (pos_X, pos_Y) in pin
 
-def str2pieces_black(piece_str : list[str]) -> Sequence[Piece]:
+def is_legal_by_trial(piece : Piece, pos_X : int, pos_Y : int, B : Board) -> bool:
     '''
-    Takes a clean string and returns the corresponding Piece item for black pieces
+    checks if the move of piece to coordinates pos_X, pos_Y leaves its king out of check by making it on B,
+    testing is_check and taking it back; assumes the piece can reach pos_X, pos_Y
     '''
-    black_king_str = [piece for piece in piece_str if piece[0] == "K"]
-    black_king = [King(location2index(piece[1:])[0], location2index(piece[1:])[1], False) for piece in black_king_str]
-    if len(black_king) != 1:
-        raise IOError
-    black_rook_str = [piece for piece in piece_str if piece[0] == "R"]
-    black_rooks = [Rook(location2index(piece[1:])[0], location2index(piece[1:])[1], False) for piece in black_rook_str]   
-    black_bishop_str = [piece for piece in piece_str if piece[0] == "B"]
-    black_bishops = [Bishop(location2index(piece[1:])[0], location2index(piece[1:])[1], False) for piece in black_bishop_str]
-    black_pieces = black_king + black_rooks + black_bishops
-    return black_pieces
+    undo = make_move(piece, pos_X, pos_Y, B)
+    try:
+        return not is_check(piece.side, B)
+    finally:
+        unmake_move(undo, B)
+
+def only_kings(B : Board) -> bool:
+    '''checks if only the two kings are left on board B, which ends the play in a draw'''
+    return len(B[1]) == 2 and all(isinstance(piece, King) for piece in B[1])
+
+def generate_legal_moves(side : bool, B : Board) -> Iterator[Tuple[Piece, int, int]]:
+    '''
+    lazily yields (P, x, y) for every piece P of side that can move on B to coordinates x,y according to chess rules
+    the moves of pieces other than the king are checked against the pins and checks of king_safety, the king's by trial
+    board B must not be changed while the generator is in use
+    '''
+    safety = None # computed on the first piece other than the king, so that is_checkmate can stop at a king move
+    pieces = [piece for piece in B[1] if piece.side == side]
+    for piece in pieces:
+        if isinstance(piece, King):
+            for square in list(piece.reachable_squares(B)):
+                if is_legal_by_trial(piece, square[0], square[1], B):
+                    yield (piece, square[0], square[1])
+            continue
+        if safety is None:
+            safety = king_safety(side, B)
+        if len(safety[1]) < 2: # against a double check only the king can move
+            for square in list(piece.reachable_squares(B)):
+                if is_safe_move(piece, square[0], square[1], safety):
+                    yield (piece, square[0], square[1])
+
+def generate_legal_moves_by_trial(side : bool, B : Board) -> Iterator[Tuple[Piece, int, int]]:
+    '''
+    yields the same moves as generate_legal_moves, every one of them checked by trying it on B
+    kept as the reference the pin and check rays of generate_legal_moves are tested against
+    '''
+    pieces = [piece for piece in B[1] if piece.side == side]
+    for piece in pieces:
+        for square in list(piece.reachable_squares(B)):
+            if is_legal_by_trial(piece, square[0], square[1], B):
+                yield (piece, square[0], square[1])
+
+def is_checkmate(side : bool, B : Board) -> bool:
+    ''' checks if configuration of B is checkmate for side '''
+    if _engine is not None:
+        return _engine.is_checkmate(side, B)
+    for _ in generate_legal_moves(side, B):
+        return False
+    return True
+
+# Board reading & saving functions and associated functions
 
 def read_board(filename : str) -> Board:
     '''
     reads board configuration from file in current directory in plain format
     raises IOError exception if file is not valid (see section Plain board configurations)
     '''
-    board_size : Union[List[str], str, int]
-    white_pieces : Union[List[str], str, Sequence[Piece]]
-    black_pieces : Union[List[str], str, Sequence[Piece]]
+    with open(filename) as plain_board:
+        lines = [plain_board.readline() for _ in range(3)]
+    return parse_board(lines)
 
-    plain_board = open(filename)
-
-    # cleaning up & preparing the board size & pieces to be read    
-    board_size = plain_board.readline()
-    board_size = clean_it(board_size)
-    board_size = int(board_size[0])
-    if type(board_size) != int or 1 > board_size > 26:
-        raise IOError
-    
-    white_pieces = plain_board.readline()
-    try:
-        white_pieces = clean_it(white_pieces)
-        white_pieces = str2pieces_white(white_pieces)
-    except ValueError:
-        raise IOError
-    
-    black_pieces = plain_board.readline()
+def parse_board(lines : Sequence[str]) -> Board:
+    '''
+    converts the three lines of a plain board configuration (size, White pieces, Black pieces) to a board
+    each line is tokenized in a single pass and every piece is validated as it is read, against the board bounds
+    and the set of squares already taken
+    raises IOError exception, with the reason as its message, if they are not valid
+    '''
+    if len(lines) < 3:
+        raise IOError("a board configuration needs three lines")
     try:
-        black_pieces = clean_it(black_pieces)
-        black_pieces = str2pieces_black(black_pieces)
+        board_size = int(lines[0].split(",")[0])
     except ValueError:
-        raise IOError
-    
-    plain_board.close()
-    pieces = white_pieces + black_pieces
-    B = (board_size, pieces)
+        raise IOError(f"invalid board size {lines[0].strip()!r}")
+    if not 2 <= board_size <= 26:
+        raise IOError(f"board size {board_size} is not between 2 and 26")
 
-    for piece in pieces:
-        if is_piece_at(piece.pos_x, piece.pos_y, B) and piece_at(piece.pos_x, piece.pos_y, B) != piece:
-            raise IOError
-        elif (piece.pos_x, piece.pos_y) not in get_squares(B):
-            raise IOError
+    piece_classes = {"K": King, "R": Rook, "B": Bishop}
+    taken = set()
+    pieces = []
+    for line, side, side_name in ((lines[1], True, "White"), (lines[2], False, "Black")):
+        by_letter : dict[str, list[Piece]] = {"K": [], "R": [], "B": []}
+        tokens = [token.strip() for token in line.split(",")]
+        if len(tokens) > 1 and not tokens[-1]: # the last "," may be omitted or not
+            tokens.pop()
+        for token in tokens:
+            if len(token) < 3 or token[0] not in piece_classes or not (token[2:].isascii() and token[2:].isdigit()):
+                raise IOError(f"invalid {side_name} piece {token!r}")
+            pos_X, pos_Y = ord(token[1].lower()) - 96, int(token[2:])
+            if not (1 <= pos_X <= board_size and 1 <= pos_Y <= board_size):
+                raise IOError(f"{token} is off the {board_size}x{board_size} board")
+            if (pos_X, pos_Y) in taken:
+                raise IOError(f"two pieces on {index2location(pos_X, pos_Y)}")
+            taken.add((pos_X, pos_Y))
+            by_letter[token[0]].append(piece_classes[token[0]](pos_X, pos_Y, side))
+        if len(by_letter["K"]) != 1:
+            raise IOError(f"{side_name} must have exactly one king")
+        pieces += by_letter["K"] + by_letter["R"] + by_letter["B"]
+    return (board_size, PieceList(pieces))
 
-    return B
+def split_records(lines : Iterable[AnyStr]) -> Iterator[list[AnyStr]]:
+    '''
+    yields the lines of many plain board configurations given one after another, optionally separated by blank lines,
+    three at a time; lines left over at the end are yielded as a last, shorter record
+    '''
+    record : list[AnyStr] = []
+    for line in lines:
+        if not record and not line.strip():
+            continue
+        record.append(line)
+        if len(record) == 3:
+            yield record
+            record = []
+    if record:
+        yield record
+
+def parse_boards(lines : Iterable[str]) -> Iterator[Board]:
+    '''
+    yields the boards of many plain board configurations given one after another, optionally separated by blank lines
+    raises IOError exception, naming the configuration, for the first one that is not valid
+    '''
+    for count, record in enumerate(split_records(lines), 1):
+        try:
+            yield parse_board(record)
+        except IOError as error:
+            raise IOError(f"board configuration {count}: {error}")
+
+def read_boards(filename : str) -> Iterator[Board]:
+    '''
+    yields every board configuration of a file in plain format holding many of them (see parse_boards),
+    reading the file through a memory map instead of loading it whole
+    '''
+    with open(filename, "rb") as plain_boards:
+        if os.fstat(plain_boards.fileno()).st_size == 0:
+            return
+        with mmap.mmap(plain_boards.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            yield from parse_boards(_decode_lines(iter(data.readline, b"")))
+
+def _decode_lines(lines : Iterable[bytes]) -> Iterator[str]:
+    '''decodes lines read from a file as UTF-8, raising IOError exception for the first one that is not valid'''
+    for number, line in enumerate(lines, 1):
+        try:
+            yield line.decode()
+        except UnicodeDecodeError:
+            raise IOError(f"line {number} is not valid UTF-8")
 
 def piece2str(piece : Piece) -> str:
-    piece_str = ""
-    if repr(piece)[0] == "K":
-        piece_str += "K"
-    elif repr(piece)[0] == "R":
-        piece_str += "R"
-    elif repr(piece)[0] == "B":
-        piece_str += "B"
-    piece_str += index2location(piece.pos_x, piece.pos_y)
-    return piece_str
+    return piece.letter + index2location(piece.pos_x, piece.pos_y)
+
+def board2str(B : Board) -> str:
+    '''converts board B to its configuration in plain format: size, White pieces and Black pieces, one line each'''
+    white_pieces = ", ".join(piece2str(piece) for piece in B[1] if piece.side == True)
+    black_pieces = ", ".join(piece2str(piece) for piece in B[1] if piece.side == False)
+    return f"{B[0]}\n{white_pieces}\n{black_pieces}\n"
 
 def save_board(filename : str, B : Board) -> None:
     '''saves board configuration into file in current directory in plain format'''
-    board_size = str(B[0])
-    white_pieces = [piece2str(piece) for piece in B[1] if piece.side == True]
-    black_pieces = [piece2str(piece) for piece in B[1] if piece.side == False]
-
-    save_file = open(filename, "w")
-    save_file.write(f"{board_size}\n")
-    for piece in white_pieces:
-        if piece == white_pieces[-1]:
-            save_file.write(f"{piece}\n")
-        else:
-            save_file.write(f"{piece}, ")
-    for piece in black_pieces:
-        if piece == black_pieces[-1]:
-            save_file.write(f"{piece}\n")
-        else:
-            save_file.write(f"{piece}, ")
-    save_file.close()
+    with open(filename, "w") as save_file:
+        save_file.write(board2str(B))
+
+# compact form of a board: its size and one (letter, side, x, y) tuple per piece, cheap to pickle between processes
+PackedBoard = tuple[int, tuple[tuple[str, bool, int, int], ...]]
+
+def pack_board(B : Board) -> PackedBoard:
+    '''converts board B to its compact packed form'''
+    return (B[0], tuple((piece.letter, piece.side, piece.pos_x, piece.pos_y) for piece in B[1]))
+
+def unpack_board(packed : PackedBoard) -> Board:
+    '''converts a packed board back to a board with new pieces (see pack_board)'''
+    piece_classes = {"K": King, "R": Rook, "B": Bishop}
+    return (packed[0], PieceList([piece_classes[letter](x, y, side) for letter, side, x, y in packed[1]]))
+
+class Position:
+    '''
+    immutable, hashable snapshot of a board: one byte per square plus the side to move
+    square (x, y) is byte (y-1)*S + (x-1), holding 0 when empty or the index + 1 of its piece in POSITION_CODES
+    '''
+    __slots__ = ("size", "squares", "white_to_move")
+    size : int
+    squares : bytes
+    white_to_move : bool
+
+    def __init__(self, size : int, squares : bytes, white_to_move : bool = True):
+        object.__setattr__(self, "size", size)
+        object.__setattr__(self, "squares", bytes(squares))
+        object.__setattr__(self, "white_to_move", white_to_move)
+
+    def __setattr__(self, name : str, value : Any) -> None:
+        raise AttributeError("Position is immutable")
+
+    def __reduce__(self) -> tuple[Any, ...]:
+        return (Position, (self.size, self.squares, self.white_to_move))
+
+    def __eq__(self, other : object) -> bool:
+        if not isinstance(other, Position):
+            return NotImplemented
+        return (self.size, self.squares, self.white_to_move) == (other.size, other.squares, other.white_to_move)
+
+    def __hash__(self) -> int:
+        return hash((self.size, self.squares, self.white_to_move))
+
+    def __repr__(self):
+        return f"Position({self.size}, {self.squares!r}, {self.white_to_move})"
+
+    @classmethod
+    def from_board(cls, B : Board, white_to_move : bool = True) -> 'Position':
+        '''takes a snapshot of board B with the given side to move'''
+        size = B[0]
+        squares = bytearray(size * size)
+        for piece in B[1]:
+            squares[(piece.pos_y - 1) * size + (piece.pos_x - 1)] = POSITION_CODES.index((piece.letter, piece.side)) + 1
+        return cls(size, squares, white_to_move)
+
+    def to_board(self) -> Board:
+        '''returns a new board with new pieces on the squares of this position, in square order'''
+        piece_classes = {"K": King, "R": Rook, "B": Bishop}
+        pieces = PieceList()
+        for index, code in enumerate(self.squares):
+            if code:
+                letter, side = POSITION_CODES[code - 1]
+                pieces.append(piece_classes[letter](index % self.size + 1, index // self.size + 1, side))
+        return (self.size, pieces)
+
+# (letter, side) of every piece kind, in the order of their codes in Position
+POSITION_CODES = (("K", True), ("R", True), ("B", True), ("K", False), ("R", False), ("B", False))
+
+# Binary board format: one byte for the board size, then two bytes per piece, big-endian,
+# holding the code of the piece in POSITION_CODES (minus one) in the top bits and its square (y-1)*S + (x-1) in the low 10 bits
+# An archive frames many of them: MAGIC, record count, the offset of every record and of the end, then the records
+
+BINARY_MAGIC = b"CPBA1"
+SQUARE_BITS = 10 # enough for the 676 squares of a 26x26 board
+
+def board2bytes(B : Board) -> bytes:
+    '''converts board B to its binary record'''
+    size = B[0]
+    record = bytearray([size])
+    for piece in B[1]:
+        entry = POSITION_CODES.index((piece.letter, piece.side)) << SQUARE_BITS | (piece.pos_y - 1) * size + piece.pos_x - 1
+        record += entry.to_bytes(2, "big")
+    return bytes(record)
+
+def bytes2board(record : bytes) -> Board:
+    '''
+    converts a binary record to a board
+    raises IOError exception, with the reason as its message, if it is not valid
+    '''
+    if len(record) < 1 or len(record) % 2 != 1:
+        raise IOError(f"invalid binary board record of {len(record)} bytes")
+    size = record[0]
+    if not 2 <= size <= 26:
+        raise IOError(f"board size {size} is not between 2 and 26")
+    piece_classes = {"K": King, "R": Rook, "B": Bishop}
+    taken = set()
+    kings = {True: 0, False: 0}
+    pieces = PieceList()
+    for i in range(1, len(record), 2):
+        entry = record[i] << 8 | record[i + 1]
+        code, square = entry >> SQUARE_BITS, entry & ((1 << SQUARE_BITS) - 1)
+        if code >= len(POSITION_CODES) or square >= size * size:
+            raise IOError(f"invalid binary piece entry {entry:#06x}")
+        if square in taken:
+            raise IOError(f"two pieces on {index2location(square % size + 1, square // size + 1)}")
+        taken.add(square)
+        letter, side = POSITION_CODES[code]
+        kings[side] += letter == "K"
+        pieces.append(piece_classes[letter](square % size + 1, square // size + 1, side))
+    if kings != {True: 1, False: 1}:
+        raise IOError("each side must have exactly one king")
+    return (size, pieces)
+
+def save_board_binary(filename : str, B : Board) -> None:
+    '''saves board configuration into file in binary format'''
+    with open(filename, "wb") as save_file:
+        save_file.write(board2bytes(B))
+
+def read_board_binary(filename : str) -> Board:
+    '''
+    reads board configuration from file in binary format
+    raises IOError exception if file is not valid (see bytes2board)
+    '''
+    with open(filename, "rb") as binary_board:
+        return bytes2board(binary_board.read())
 
+def save_boards_binary(filename : str, boards : Iterable[Board]) -> int:
+    '''saves every board into an archive file with a single write and returns how many were saved'''
+    records = [board2bytes(B) for B in boards]
+    offsets = [0]
+    for record in records:
+        offsets.append(offsets[-1] + len(record))
+    header = BINARY_MAGIC + len(records).to_bytes(4, "big") + b"".join(offset.to_bytes(4, "big") for offset in offsets)
+    with open(filename, "wb") as save_file:
+        save_file.write(header + b"".join(records))
+    return len(records)
+
+class BoardArchive:
+    '''
+    archive file of binary board records, memory-mapped so that any board can be read by its index without reading the others
+    raises IOError exception if the file is not an archive
+    '''
+
+    def __init__(self, filename : str):
+        with open(filename, "rb") as archive_file:
+            if os.fstat(archive_file.fileno()).st_size == 0: # an empty file cannot be mapped
+                raise IOError(f"{filename} is not a board archive")
+            self.data = mmap.mmap(archive_file.fileno(), 0, access=mmap.ACCESS_READ)
+        start = len(BINARY_MAGIC)
+        if self.data[:start] != BINARY_MAGIC:
+            self.data.close()
+            raise IOError(f"{filename} is not a board archive")
+        self.count = int.from_bytes(self.data[start:start + 4], "big")
+        self.offsets = start + 4
+        self.records = self.offsets + 4 * (self.count + 1)
+        if len(self.data) < self.records:
+            self.data.close()
+            raise IOError(f"{filename} is a truncated board archive")
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, index : int) -> Board:
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("board archive index out of range")
+        at = self.offsets + 4 * index
+        start, end = int.from_bytes(self.data[at:at + 4], "big"), int.from_bytes(self.data[at + 4:at + 8], "big")
+        return bytes2board(self.data[self.records + start:self.records + end])
+
+    def __iter__(self) -> Iterator[Board]:
+        for index in range(self.count):
+            yield self[index]
+
+    def close(self) -> None:
+        self.data.close()
+
+    def __enter__(self) -> 'BoardArchive':
+        return self
+
+    def __exit__(self, *exc_info : Any) -> None:
+        self.close()
+
+def plain2binary(plain_filename : str, binary_filename : str) -> int:
+    '''converts a file of plain board configurations (see read_boards) to an archive, returning the number of boards'''
+    return save_boards_binary(binary_filename, read_boards(plain_filename))
+
+def binary2plain(binary_filename : str, plain_filename : str) -> int:
+    '''converts an archive to a file of plain board configurations with a single write, returning the number of boards'''
+    with BoardArchive(binary_filename) as archive:
+        text = "".join(board2str(B) for B in archive)
+        count = len(archive)
+    with open(plain_filename, "w") as save_file:
+        save_file.write(text)
+    return count
+
+# Position analysis cache: the legal moves, check status and checkmate verdict of a side on a position, kept in a bounded
+# LRU keyed by the Position snapshot of the board with that side to move, so that a changed board simply misses
+
+ANALYSIS_CACHE_SIZE = 4096 # positions kept before the least recently used one is evicted
+
+# (legal moves as (from x, from y, to x, to y), is check, is checkmate)
+Analysis = tuple[tuple[tuple[int, int, int, int], ...], bool, bool]
+
+class AnalysisCache:
+    '''bounded LRU cache of position analyses, counting its hits and misses'''
+
+    def __init__(self, max_entries : int = ANALYSIS_CACHE_SIZE):
+        self.max_entries = max(1, max_entries)
+        self.entries : OrderedDict[Position, Analysis] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def analyse(self, side : bool, B : Board) -> Analysis:
+        '''returns the analysis of side to move on board B, computing it only if it is not cached'''
+        key = Position.from_board(B, side)
+        analysis = self.entries.get(key)
+        if analysis is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return analysis
+        self.misses += 1
+        moves = tuple((piece.pos_x, piece.pos_y, x, y) for piece, x, y in generate_legal_moves(side, B))
+        analysis = (moves, is_check(side, B), not moves)
+        self.entries[key] = analysis
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return analysis
+
+    def stats(self) -> dict[str, Any]:
+        '''returns the hits, misses, hit rate and number of entries'''
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self.entries)}
+
+    def clear(self) -> None:
+        '''drops every entry and resets the statistics'''
+        self.entries.clear()
+        self.hits = self.misses = 0
+
+_analysis_cache : Optional[AnalysisCache] = None # used by play_game and find_black_move when set
+
+def set_analysis_cache(cache : Optional[AnalysisCache]) -> None:
+    '''selects the cache play_game and find_black_move analyse positions through, None to analyse every position afresh'''
+    global _analysis_cache
+    _analysis_cache = cache
+
+# endgame tables loaded by chess_tablebase.load_tablebase, keyed by (board size, material signature)
+TABLEBASES : dict[tuple[int, str], Any] = {}
 
 def find_black_move(B : Board) -> Tuple[Piece, int, int]:
     '''
     returns (P, x, y) where a Black piece P can move on B to coordinates x,y according to chess rules
+    plays the tablebase move when a loaded endgame table covers B, and takes the moves from the analysis cache when one is set
     assumes there is at least one black piece that can move somewhere
     '''
-    black_pieces = [piece for piece in B[1] if piece.side == False]
-    not_valid_move = True
-    while not_valid_move:
-        moving_piece = choice(black_pieces)
-        move_location = choice(get_squares(B))
-        black_can_move = moving_piece.can_move_to(move_location[0], move_location[1], B)
-        if black_can_move:
-            not_valid_move = False
-    return (moving_piece, move_location[0], move_location[1]) 
+    if TABLEBASES:
+        from chess_tablebase import best_move
+        move = best_move(False, B)
+        if move is not None:
+            return move
+    if _analysis_cache is not None:
+        from_x, from_y, to_x, to_y = choice(_analysis_cache.analyse(False, B)[0])
+        return (piece_at(from_x, from_y, B), to_x, to_y)
+    return choice(list(generate_legal_moves(False, B)))
+
+BLACK_STRATEGIES = ("random", "search")
+
+def black_player(strategy : str) -> Any:
+    '''
+    returns a function taking a board B and returning Black's move (P, x, y) on it, as find_black_move does
+    "random" is find_black_move itself, "search" a chess_search.SearchPlayer thinking for CHESS_SEARCH_TIME seconds (1 by default)
+    raises ValueError for any other strategy
+    '''
+    if strategy == "random":
+        return find_black_move
+    elif strategy == "search":
+        from chess_search import SearchPlayer
+        return SearchPlayer(time_limit=float(os.environ.get("CHESS_SEARCH_TIME", "1")))
+    raise ValueError(f"unknown Black strategy {strategy!r}, expected one of {BLACK_STRATEGIES}")
 
 # Board display functions for UI
 
 def make_board_matrix(B : Board) -> List[List[Tuple[int, int]]]:
     '''converts list of squares on the board to a matrix representing the board'''
-    board = []
-    squares = get_squares(B)
-    for rows in range(1, B[0]+1):
-        row = [square for square in squares if square[1] == rows]
-        board.append(row)
-    board.reverse() 
-    return board
+    return [list(row) for row in geometry(B[0]).rows]
 
 def conf2unicode(B : Board) -> str:
     '''converts board cofiguration B to unicode format string (see section Unicode board configurations)'''
-    square : Any
-    empty_board : List[List[Tuple[int, int]]]
+    size = B[0]
+    grid = [["\u2001"] * size for _ in range(size)] # top row first
+    for piece in B[1]:
+        grid[size - piece.pos_y][piece.pos_x - 1] = piece.piece_code
+    return "\n".join("".join(row) for row in grid)
 
-    empty_board = make_board_matrix(B)
-    pieces_and_spaces = []
-    for row in empty_board:
-        for square in row:
-            if is_piece_at(square[0], square[1], B):
-                square = piece_at(square[0], square[1], B).piece_code
-                pieces_and_spaces.append(square)
-            else:
-                square = "\u2001"
-                pieces_and_spaces.append(square)
-        pieces_and_spaces.append("\n")
-    board = "".join([str(square) for square in pieces_and_spaces])
-    board = board.rstrip("\n") # removes the trailing newline on the last row
-    return board
+def conf2unicode_diff(previous : Optional['Position'], current : 'Position', top_line : int = 1) -> str:
+    '''
+    returns the ANSI terminal sequences turning the board of position previous, as printed by conf2unicode with its top row
+    on terminal line top_line, into that of position current: only the changed squares are redrawn, then the cursor is left
+    on the line below the board; every square is drawn when previous is None or of another size
+    '''
+    size = current.size
+    piece_classes = {"K": King, "R": Rook, "B": Bishop}
+    if previous is None or previous.size != size:
+        changed = range(size * size)
+    else:
+        changed = [index for index, (old, new) in enumerate(zip(previous.squares, current.squares)) if old != new]
+    updates = []
+    for index in changed:
+        code = current.squares[index]
+        if code:
+            letter, side = POSITION_CODES[code - 1]
+            cell = piece_classes[letter].piece_codes[0 if side else 1]
+        else:
+            cell = "\u2001"
+        updates.append(f"\x1b[{top_line + size - 1 - index // size};{index % size + 1}H{cell}")
+    updates.append(f"\x1b[{top_line + size};1H")
+    return "".join(updates)
 
 def split_player_move(move_string : str) -> list[str]:
     '''
@@ -411,43 +966,109 @@ def split_player_move(move_string : str) -> list[str]:
     end_loc = move_string[end_col:]
     return [start_loc, end_loc]
 
+# Game runner: the turn logic of play, with pluggable move providers for both sides
+# a move provider is a function taking a board B and returning the move (P, x, y) of its side on it, as find_black_move does
+
+def random_player(side : bool) -> Any:
+    '''returns a move provider playing a uniformly random legal move of side'''
+    def provider(B : Board) -> Tuple[Piece, int, int]:
+        return choice(list(generate_legal_moves(side, B)))
+    return provider
+
+def scripted_player(moves : Sequence[str]) -> Any:
+    '''
+    returns a move provider playing the given moves in the split_player_move syntax, e.g. a2a4, one per call
+    the provider raises IOError exception when the next move is not a valid move or there is none left
+    '''
+    remaining = iter(moves)
+    def provider(B : Board) -> Tuple[Piece, int, int]:
+        move_string = next(remaining, None)
+        if move_string is None:
+            raise IOError("no scripted move left")
+        start_loc, end_loc = split_player_move(move_string)
+        start_x, start_y = location2index(start_loc)
+        end_x, end_y = location2index(end_loc)
+        if not is_piece_at(start_x, start_y, B) or not piece_at(start_x, start_y, B).can_move_to(end_x, end_y, B):
+            raise IOError(f"{move_string} is not a valid move")
+        return (piece_at(start_x, start_y, B), end_x, end_y)
+    return provider
+
+def play_game(B : Board, white : Any, black : Any, max_moves : Optional[int] = None, on_move : Any = None) -> tuple[str, int]:
+    '''
+    plays the game on board B, White first, asking the move providers white and black for their moves, and returns
+    ("white", n) or ("black", n) when that side wins by checkmate after n moves, or ("draw", n) when only the kings are left
+    or max_moves moves have been played; the positions are analysed through the analysis cache when one is set
+    on_move, if given, is called after every move with the side that moved, the move in the split_player_move syntax and B
+    B is played on in place
+    '''
+    moves = 0
+    side = True
+    while True:
+        if only_kings(B) or (max_moves is not None and moves >= max_moves):
+            return ("draw", moves)
+        piece, pos_X, pos_Y = (white if side else black)(B)
+        move_string = index2location(piece.pos_x, piece.pos_y) + index2location(pos_X, pos_Y)
+        make_move(piece, pos_X, pos_Y, B)
+        moves += 1
+        if _analysis_cache is not None:
+            checkmate = _analysis_cache.analyse(not side, B)[2]
+        else:
+            checkmate = is_checkmate(not side, B)
+        if on_move is not None:
+            on_move(side, move_string, B)
+        if checkmate:
+            return ("white" if side else "black", moves)
+        side = not side
+
 # Implementation of play
 
 def main() -> None:
     ''' runs the play '''
+    set_engine(os.environ.get("CHESS_ENGINE", "pieces"))
+    import chess_profile # wraps nothing until enabled
+    profile_format = os.environ.get(chess_profile.PROFILE_ENV, "")
+    if profile_format: # opt-in profiling of the hot functions, summarised at the end of the play
+        if profile_format not in chess_profile.FORMATS:
+            raise ValueError(f"unknown profile format {profile_format!r}, expected one of {chess_profile.FORMATS}")
+        profiler = chess_profile.enable()
+    black_strategy = black_player(os.environ.get("CHESS_BLACK", "random"))
+    analysis_cache = AnalysisCache(int(os.environ.get("CHESS_CACHE_SIZE", str(ANALYSIS_CACHE_SIZE))))
+    set_analysis_cache(analysis_cache)
+
+    def end_profile() -> None:
+        '''prints the profile summary, if profiling, on every way out of the play'''
+        if profile_format:
+            chess_profile.disable()
+            print(profiler.report(profile_format))
+            print(f"Analysis cache: {analysis_cache.stats()}")
+
     looking_for_valid_board = True
     filename = input("File name for initial configuration: ")
 
     while looking_for_valid_board:
         if filename == "QUIT": # if user types "QUIT" terminate the programme
+            end_profile()
             quit()
         else:
             try: # if valid file -> store file in plain board configuration
-                current_board = read_board(filename)
+                current_board = track_attacks(read_board(filename))
                 save_board(filename, current_board)
                 print("The initial configuration is:")
                 print(conf2unicode(current_board))
                 looking_for_valid_board = False
             except IOError:
                 filename = input("This is not a valid file. File name for initial configuration: ")
-    
-    in_play = True
-    white_turn = True
-    
-    # process for each side taking turns
-    while in_play:
-        # determing if only kings left on each side. If so, end play and call a draw
-        if len(current_board[1]) == 2 and repr(current_board[1][0])[:4] == repr(current_board[1][1])[:4]:
-           in_play = False
-        
-        # white move process
-        elif white_turn:
+
+    def white_player(B : Board) -> Tuple[Piece, int, int]:
+        '''asks for White's move until a valid one is given'''
+        while True:
             white_move = input("Next move of White: ")
-            
+
             if white_move == "QUIT": # if user types "QUIT" terminate the programme
                 savename = input("File name to store the configuration: ")
-                save_board(savename, current_board)
-                quit()         
+                save_board(savename, B)
+                end_profile()
+                quit()
             try:
                 start_loc = split_player_move(white_move)[0] # location of piece to move
                 end_loc = split_player_move(white_move)[1] # desired end location
@@ -457,41 +1078,41 @@ def main() -> None:
                 end_x = location2index(end_loc)[0]
                 end_y = location2index(end_loc)[1]
 
-                if not is_piece_at(start_x, start_y, current_board): # check is piece is at start location
+                if not is_piece_at(start_x, start_y, B): # check is piece is at start location
                     raise IOError
 
-                white_move_piece = piece_at(start_x, start_y, current_board) # moving piece
-    
-                if not white_move_piece.can_move_to(end_x, end_y, current_board): # check valid move
-                    raise IOError
-                
-                current_board = white_move_piece.move_to(end_x, end_y, current_board) # update the board
-                print("The configuration after White's move is: ")
-                print(conf2unicode(current_board))
-                white_turn = False
+                white_move_piece = piece_at(start_x, start_y, B) # moving piece
 
-                if is_checkmate(False, current_board): # check if Black is in checkmate
-                    print("Game over. White wins.")
-                    quit()
+                if not white_move_piece.can_move_to(end_x, end_y, B): # check valid move
+                    raise IOError
+                return (white_move_piece, end_x, end_y)
 
-            except IOError:
+            except (IOError, ValueError):
                 print("This is not a valid move.")
 
-    # Black move process
+    def show_move(side : bool, move_string : str, B : Board) -> None:
+        '''prints the configuration after each move'''
+        if profile_format:
+            profiler.end_move(("White " if side else "Black ") + move_string)
+        if side:
+            print("The configuration after White's move is: ")
+            print(conf2unicode(B))
         else:
-            black_move = find_black_move(current_board)
-            black_move_piece = black_move[0]
-            black_move_str = index2location(black_move_piece.pos_x, black_move_piece.pos_y) + index2location(black_move[1], black_move[2])
-            current_board = black_move_piece.move_to(black_move[1], black_move[2], current_board)
-            print(f"Next move of Black is {black_move_str}. The configuration after Black's move is: ")
-            print(conf2unicode(current_board))
-            white_turn = True
-
-            if is_checkmate(True, current_board): # check if White is in checkmate
-                print("Game over. Black wins.")
-                quit()
-    
-    print("Game over. It's a draw.")
+            print(f"Next move of Black is {move_string}. The configuration after Black's move is: ")
+            print(conf2unicode(B))
+            if hasattr(black_strategy, "report"): # search statistics: nodes per second and TT hit rate
+                print(black_strategy.report())
+
+    result, _ = play_game(current_board, white_player, black_strategy, on_move=show_move)
+    if result == "white":
+        print("Game over. White wins.")
+    elif result == "black":
+        print("Game over. Black wins.")
+    else:
+        print("Game over. It's a draw.")
+    end_profile()
 
 if __name__ == '__main__': #keep this in
-   main()
+   # run the play from the importable module so that helper modules (chess_search, ...) share its classes
+   import chess_puzzle_final
+   chess_puzzle_final.main()
@@ -0,0 +1,242 @@
+import time
+from functools import lru_cache
+from random import Random
+from typing import Any, Optional, Tuple
+
+from chess_puzzle_final import (GEOMETRY_CACHE_SIZE, TABLEBASES, Board, Piece, generate_legal_moves, is_check,
+                                make_move, only_kings, piece_at, unmake_move)
+
+# Search-based Black player: negamax with alpha-beta pruning and iterative deepening,
+# backed by a Zobrist-hashed transposition table of bounded size
+
+MATE = 100000 # score of giving mate now, reduced by one per ply so that quicker mates score higher
+PIECE_VALUES = {"K": 0, "R": 5, "B": 3}
+
+EXACT, LOWER, UPPER = 0, 1, 2 # kind of bound stored with a transposition table score
+
+Move = Tuple[int, int, int, int] # (from x, from y, to x, to y)
+
+@lru_cache(maxsize=GEOMETRY_CACHE_SIZE)
+def zobrist_keys(size : int) -> tuple[dict[tuple[str, bool, int, int], int], int]:
+    '''
+    returns the random 64-bit keys of every (piece type, side, square) of a board of the given size,
+    and the key xor-ed in when Black is to move; the keys are seeded by the board size so they are reproducible
+    '''
+    rng = Random(size)
+    keys = {(letter, side, x, y): rng.getrandbits(64)
+            for letter in ("K", "R", "B") for side in (True, False)
+            for x in range(1, size+1) for y in range(1, size+1)}
+    return keys, rng.getrandbits(64)
+
+def zobrist_hash(B : Board, side : bool) -> int:
+    '''returns the Zobrist hash of board B with side to move'''
+    keys, black_key = zobrist_keys(B[0])
+    key = 0 if side else black_key
+    for piece in B[1]:
+        key ^= keys[(piece.letter, piece.side, piece.pos_x, piece.pos_y)]
+    return key
+
+class TranspositionTable:
+    '''
+    fixed number of slots indexed by hash, sized from a memory cap
+    replacement "depth" keeps the deeper of two colliding entries, "always" lets the newest entry win
+    '''
+    ENTRY_BYTES = 200 # rough size of one stored entry with its tuple and ints
+    REPLACEMENTS = ("depth", "always")
+
+    def __init__(self, max_bytes : int = 16 * 2**20, replacement : str = "depth"):
+        if replacement not in self.REPLACEMENTS:
+            raise ValueError(f"unknown replacement policy {replacement!r}, expected one of {self.REPLACEMENTS}")
+        self.capacity = max(1, max_bytes // self.ENTRY_BYTES)
+        self.replacement = replacement
+        self.slots : list[Optional[tuple[int, int, int, int, Optional[Move]]]] = [None] * self.capacity
+        self.probes = 0
+        self.hits = 0
+
+    def probe(self, key : int) -> Optional[tuple[int, int, int, int, Optional[Move]]]:
+        '''returns the entry (key, depth, score, bound, best move) stored for key, if any'''
+        self.probes += 1
+        entry = self.slots[key % self.capacity]
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry
+        return None
+
+    def store(self, key : int, depth : int, score : int, bound : int, move : Optional[Move]) -> None:
+        '''stores an entry for key, subject to the replacement policy'''
+        index = key % self.capacity
+        old = self.slots[index]
+        if self.replacement == "depth" and old is not None and old[0] != key and old[1] > depth:
+            return
+        self.slots[index] = (key, depth, score, bound, move)
+
+    def hit_rate(self) -> float:
+        return self.hits / self.probes if self.probes else 0.0
+
+class SearchTimeout(Exception):
+    '''raised inside the search when the time budget for a move runs out'''
+
+def evaluate(side : bool, B : Board) -> int:
+    '''returns the material balance of board B from the point of view of side'''
+    score = 0
+    for piece in B[1]:
+        value = PIECE_VALUES[piece.letter]
+        score += value if piece.side == side else -value
+    return score
+
+class SearchPlayer:
+    '''
+    picks moves by iterative deepening negamax with alpha-beta pruning under a wall-clock budget
+    moves are tried best-known first, then captures, then checks, then the rest
+    '''
+
+    def __init__(self, time_limit : float = 1.0, max_depth : int = 32, tt_bytes : int = 16 * 2**20,
+                 replacement : str = "depth", side : bool = False):
+        self.time_limit = time_limit
+        self.max_depth = max_depth
+        self.side = side
+        self.tt = TranspositionTable(tt_bytes, replacement)
+        self.nodes = 0
+        self.deadline = 0.0
+        self.stats : dict[str, Any] = {}
+
+    def __call__(self, B : Board) -> Tuple[Piece, int, int]:
+        return self.choose_move(B)
+
+    def choose_move(self, B : Board) -> Tuple[Piece, int, int]:
+        '''
+        returns (P, x, y) where a piece P of this player's side can move on B to coordinates x,y according to chess rules
+        assumes there is at least one such move
+        '''
+        if TABLEBASES:
+            from chess_tablebase import best_move
+            move = best_move(self.side, B)
+            if move is not None:
+                self.stats = {"depth": 0, "score": 0, "nodes": 0, "seconds": 0.0, "nodes_per_second": 0.0,
+                              "tt_hit_rate": 0.0, "tablebase": True}
+                return move
+        start = time.perf_counter()
+        self.deadline = start + self.time_limit
+        self.nodes = 0
+        probes, hits = self.tt.probes, self.tt.hits
+        key = zobrist_hash(B, self.side)
+        moves = [(piece.pos_x, piece.pos_y, x, y) for piece, x, y in generate_legal_moves(self.side, B)]
+        best_move, best_score, depth_reached = moves[0], 0, 0
+        if len(moves) > 1:
+            for depth in range(1, self.max_depth + 1):
+                try:
+                    score, move = self._root(B, depth, key, moves, best_move)
+                except SearchTimeout:
+                    break
+                best_move, best_score, depth_reached = move, score, depth
+                if abs(score) >= MATE - self.max_depth: # forced mate found, deeper search cannot improve it
+                    break
+        elapsed = time.perf_counter() - start
+        move_probes = self.tt.probes - probes
+        self.stats = {
+            "depth": depth_reached,
+            "score": best_score,
+            "nodes": self.nodes,
+            "seconds": elapsed,
+            "nodes_per_second": self.nodes / elapsed if elapsed > 0 else 0.0,
+            "tt_hit_rate": (self.tt.hits - hits) / move_probes if move_probes else 0.0,
+        }
+        return (piece_at(best_move[0], best_move[1], B), best_move[2], best_move[3])
+
+    def report(self) -> str:
+        '''returns a one-line summary of the search behind the last move'''
+        stats = self.stats
+        if stats.get("tablebase"):
+            return "Move taken from the endgame tablebase"
+        return (f"Search depth {stats['depth']}, {stats['nodes']} nodes, "
+                f"{stats['nodes_per_second']:.0f} nodes/s, TT hit rate {stats['tt_hit_rate']:.1%}")
+
+    def _root(self, B : Board, depth : int, key : int, moves : list[Move], first : Move) -> tuple[int, Move]:
+        '''searches every root move to depth, previous best move first'''
+        alpha, beta = -MATE - 1, MATE + 1
+        best_move = first
+        for move in [first] + [move for move in moves if move != first]:
+            score = -self._child(B, self.side, move, depth, -beta, -alpha, 1, key)
+            if score > alpha:
+                alpha, best_move = score, move
+        self.tt.store(key, depth, alpha, EXACT, best_move)
+        return alpha, best_move
+
+    def _child(self, B : Board, side : bool, move : Move, depth : int, alpha : int, beta : int, ply : int, key : int) -> int:
+        '''makes move for side, searches the resulting position for the other side and takes the move back'''
+        keys, black_key = zobrist_keys(B[0])
+        piece = piece_at(move[0], move[1], B)
+        letter = piece.letter
+        undo = make_move(piece, move[2], move[3], B)
+        child_key = key ^ black_key ^ keys[(letter, side, move[0], move[1])] ^ keys[(letter, side, move[2], move[3])]
+        captured = undo[3]
+        if captured is not None:
+            child_key ^= keys[(captured.letter, captured.side, move[2], move[3])]
+        try:
+            return self._negamax(B, not side, depth - 1, alpha, beta, ply, child_key)
+        finally:
+            unmake_move(undo, B)
+
+    def _negamax(self, B : Board, side : bool, depth : int, alpha : int, beta : int, ply : int, key : int) -> int:
+        '''returns the score of board B for side to move, searched to depth within the window alpha, beta'''
+        self.nodes += 1
+        if time.perf_counter() > self.deadline: # a clock read is cheap next to the move generation of a node
+            raise SearchTimeout
+        if only_kings(B):
+            return 0
+        entry = self.tt.probe(key)
+        tt_move = None
+        if entry is not None:
+            tt_move = entry[4]
+            if entry[1] >= depth:
+                score = from_tt(entry[2], ply)
+                if entry[3] == EXACT or (entry[3] == LOWER and score >= beta) or (entry[3] == UPPER and score <= alpha):
+                    return score
+        moves = [(piece.pos_x, piece.pos_y, x, y) for piece, x, y in generate_legal_moves(side, B)]
+        if not moves: # no legal move is checkmate in this game
+            return -MATE + ply
+        if depth <= 0:
+            return evaluate(side, B)
+        alpha_start = alpha
+        best_score, best_move = -MATE - 1, None
+        for move in self._ordered(B, side, moves, tt_move):
+            score = -self._child(B, side, move, depth, -beta, -alpha, ply + 1, key)
+            if score > best_score:
+                best_score, best_move = score, move
+            alpha = max(alpha, score)
+            if alpha >= beta:
+                break
+        bound = UPPER if best_score <= alpha_start else LOWER if best_score >= beta else EXACT
+        self.tt.store(key, depth, to_tt(best_score, ply), bound, best_move)
+        return best_score
+
+    def _ordered(self, B : Board, side : bool, moves : list[Move], tt_move : Optional[Move]) -> list[Move]:
+        '''orders moves: transposition table move, then captures, then checks, then the rest'''
+        def rank(move : Move) -> int:
+            if move == tt_move:
+                return 0
+            piece = piece_at(move[0], move[1], B)
+            undo = make_move(piece, move[2], move[3], B)
+            try:
+                if undo[3] is not None:
+                    return 1
+                return 2 if is_check(not side, B) else 3
+            finally:
+                unmake_move(undo, B)
+        return sorted(moves, key=rank)
+
+def to_tt(score : int, ply : int) -> int:
+    '''converts a mate score relative to the root into one relative to the stored position'''
+    if score >= MATE - 1000:
+        return score + ply
+    if score <= -MATE + 1000:
+        return score - ply
+    return score
+
+def from_tt(score : int, ply : int) -> int:
+    '''converts a stored mate score back to one relative to the root'''
+    if score >= MATE - 1000:
+        return score - ply
+    if score <= -MATE + 1000:
+        return score + ply
+    return score
@@ -0,0 +1,167 @@
+import argparse
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Any, Optional, Sequence
+
+from chess_puzzle_final import (BLACK_STRATEGIES, PackedBoard, black_player, conf2unicode, only_kings, pack_board,
+                                parse_board, play_game, scripted_player, unpack_board)
+
+# Puzzle server: many play sessions over TCP from one process, one session per connection
+# The protocol is line based, in UTF-8; every request gets a status line followed by as many lines as it announces:
+#   LOAD, then the three lines of a plain board configuration -> OK n, then the n rows of the board
+#   MOVE a2a4 (White's move, in the split_player_move syntax) -> OK n, then "BLACK b4a4" if Black replied,
+#                                                               "RESULT white|black|draw" if the game is over, then the board
+#   QUIT                                                         -> OK 0, and the connection is closed
+#   anything invalid                                             -> ERR reason, lines that are not UTF-8 or are longer
+#                                                                   than the stream limit included
+# The moves themselves, with their is_checkmate tests and Black's choice, run in an executor so that the event loop
+# keeps serving the other sessions
+
+def play_turn(packed : PackedBoard, white_move : str, strategy : str) -> dict[str, Any]:
+    '''
+    plays White's move and Black's reply on a packed board and returns the packed board after them, Black's move
+    (None if the game ended first), the result ("white", "black", "draw" or None while the game goes on) and the rendering
+    returns {"error": reason} instead when White's move is not valid
+    '''
+    B = unpack_board(packed)
+    black_moves : list[str] = []
+    def record(side : bool, move_string : str, B : Any) -> None:
+        if not side:
+            black_moves.append(move_string)
+    try:
+        result, _ = play_game(B, scripted_player([white_move]), black_player(strategy), max_moves=2, on_move=record)
+    except (IOError, ValueError):
+        return {"error": "This is not a valid move."}
+    if result == "draw" and not only_kings(B): # stopped by the move cap, not a draw
+        result = None
+    return {"board": pack_board(B), "black": black_moves[0] if black_moves else None, "result": result,
+            "rendering": conf2unicode(B)}
+
+async def reply(writer : asyncio.StreamWriter, lines : Sequence[str]) -> None:
+    '''sends an OK response with lines'''
+    writer.write(("\n".join([f"OK {len(lines)}", *lines]) + "\n").encode())
+    await writer.drain()
+
+async def error(writer : asyncio.StreamWriter, reason : str) -> None:
+    '''sends an ERR response'''
+    writer.write(f"ERR {reason}\n".encode())
+    await writer.drain()
+
+async def read_line(reader : asyncio.StreamReader) -> str:
+    '''
+    returns the next line of reader, "" at the end of the connection
+    raises IOError exception if the line is not valid UTF-8 or is longer than the stream limit, the whole line being skipped
+    '''
+    too_long = False
+    while True:
+        try:
+            line = await reader.readuntil(b"\n")
+        except asyncio.IncompleteReadError as end:
+            line = end.partial
+        except asyncio.LimitOverrunError as overrun:
+            await reader.readexactly(overrun.consumed) # drops the start of the line and looks again for its end
+            too_long = True
+            continue
+        break
+    if too_long:
+        raise IOError("line too long")
+    try:
+        return line.decode()
+    except UnicodeDecodeError:
+        raise IOError("line is not valid UTF-8")
+
+async def handle_session(reader : asyncio.StreamReader, writer : asyncio.StreamWriter, strategy : str,
+                         executor : Optional[Executor]) -> None:
+    '''serves the requests of one connection until QUIT or the end of the connection'''
+    loop = asyncio.get_running_loop()
+    packed : Optional[PackedBoard] = None
+    over = False
+    try:
+        while True:
+            try:
+                line = await read_line(reader)
+            except IOError as reason:
+                await error(writer, str(reason))
+                continue
+            if not line:
+                break
+            command, _, argument = line.strip().partition(" ")
+            if command == "LOAD":
+                lines : list[str] = []
+                unreadable : Optional[IOError] = None
+                for _ in range(3): # all three lines are read, even past an unreadable one, to stay in step with the client
+                    try:
+                        lines.append(await read_line(reader))
+                    except IOError as reason:
+                        unreadable = unreadable or reason
+                if unreadable is not None:
+                    await error(writer, str(unreadable))
+                    continue
+                try:
+                    B = parse_board(lines)
+                except IOError as reason:
+                    await error(writer, str(reason) or "This is not a valid file.")
+                    continue
+                packed, over = pack_board(B), only_kings(B)
+                await reply(writer, conf2unicode(B).split("\n"))
+            elif command == "MOVE":
+                if packed is None:
+                    await error(writer, "no board loaded")
+                elif over:
+                    await error(writer, "the game is over")
+                else:
+                    turn = await loop.run_in_executor(executor, play_turn, packed, argument.strip(), strategy)
+                    if "error" in turn:
+                        await error(writer, turn["error"])
+                        continue
+                    packed, over = turn["board"], turn["result"] is not None
+                    lines = [f"BLACK {turn['black']}"] if turn["black"] is not None else []
+                    lines += [f"RESULT {turn['result']}"] if over else []
+                    await reply(writer, lines + turn["rendering"].split("\n"))
+            elif command == "QUIT":
+                await reply(writer, [])
+                break
+            else:
+                await error(writer, f"unknown command {command!r}")
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+async def start_server(host : str = "127.0.0.1", port : int = 8765, strategy : str = "random",
+                       executor : Optional[Executor] = None) -> asyncio.base_events.Server:
+    '''
+    starts serving play sessions on host, port (0 picks a free port) with Black playing strategy (see black_player),
+    running the moves in executor (the default executor of the event loop if None)
+    '''
+    if strategy not in BLACK_STRATEGIES:
+        raise ValueError(f"unknown Black strategy {strategy!r}, expected one of {BLACK_STRATEGIES}")
+    return await asyncio.start_server(lambda reader, writer: handle_session(reader, writer, strategy, executor), host, port)
+
+async def serve(host : str, port : int, strategy : str, workers : int) -> None:
+    '''serves play sessions until interrupted, with the moves run across workers processes (threads if 0)'''
+    executor = ProcessPoolExecutor(workers) if workers > 0 else None
+    try:
+        server = await start_server(host, port, strategy, executor)
+        async with server:
+            print(f"serving on {', '.join(str(sock.getsockname()) for sock in server.sockets)}")
+            await server.serve_forever()
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+def main(argv : Optional[Sequence[str]] = None) -> None:
+    ''' runs the puzzle server '''
+    parser = argparse.ArgumentParser(description="Serve play sessions over TCP with a line protocol.")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=8765, help="port to listen on")
+    parser.add_argument("--black", choices=BLACK_STRATEGIES, default="random", help="Black strategy")
+    parser.add_argument("--workers", type=int, default=0, help="worker processes for the moves (0 runs them in threads)")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port, args.black, args.workers))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+import argparse
+from multiprocessing import Pool
+from typing import Optional, Sequence
+
+from chess_puzzle_final import (TABLEBASES, Board, PackedBoard, generate_legal_moves, index2location, is_checkmate, make_move,
+                                only_kings, pack_board, piece_at, read_board, unmake_move, unpack_board)
+
+# Mate-in-N solver for White to move, using the same is_check / is_checkmate rules as the game:
+# a side left without a legal move after the other side's move has lost, and a board with only the two kings is a draw
+
+Move = tuple[int, int, int, int] # (from x, from y, to x, to y)
+
+def move2str(move : Move) -> str:
+    '''converts a move to the start and end locations syntax read by split_player_move, e.g. a2a4'''
+    return index2location(move[0], move[1]) + index2location(move[2], move[3])
+
+def legal_moves(side : bool, B : Board) -> list[Move]:
+    '''returns every legal move of side on B as coordinates'''
+    return [(piece.pos_x, piece.pos_y, x, y) for piece, x, y in generate_legal_moves(side, B)]
+
+def white_mates(B : Board, move : Move, n : int) -> Optional[list[Move]]:
+    '''
+    returns the mating line starting with White's move on B if it forces mate within n White moves, None otherwise
+    B is restored before returning
+    '''
+    undo = make_move(piece_at(move[0], move[1], B), move[2], move[3], B)
+    try:
+        if is_checkmate(False, B):
+            return [move]
+        if n == 1 or only_kings(B):
+            return None
+        line = black_loses(B, n - 1)
+        return None if line is None else [move] + line
+    finally:
+        unmake_move(undo, B)
+
+def black_loses(B : Board, n : int) -> Optional[list[Move]]:
+    '''
+    returns the line after Black's most stubborn reply on B if every reply allows White a mate within n moves, None otherwise
+    '''
+    longest : list[Move] = []
+    for reply in legal_moves(False, B):
+        undo = make_move(piece_at(reply[0], reply[1], B), reply[2], reply[3], B)
+        try:
+            if is_checkmate(True, B) or only_kings(B):
+                return None
+            line = white_wins(B, n)
+        finally:
+            unmake_move(undo, B)
+        if line is None:
+            return None
+        if len(line) + 1 > len(longest):
+            longest = [reply] + line
+    return longest
+
+def white_wins(B : Board, n : int) -> Optional[list[Move]]:
+    '''returns a mating line for White to move on B within n White moves, None if there is none'''
+    for move in legal_moves(True, B):
+        line = white_mates(B, move, n)
+        if line is not None:
+            return line
+    return None
+
+def _solve_root(task : tuple[PackedBoard, Move, int]) -> Optional[list[Move]]:
+    '''worker: solves one root move of a packed board'''
+    packed, move, n = task
+    return white_mates(unpack_board(packed), move, n)
+
+def solve_mate(B : Board, n : int, workers : int = 1) -> Optional[list[str]]:
+    '''
+    returns the shortest forced mate for White to move on B within n White moves, as moves in the split_player_move syntax
+    with Black's most stubborn replies in between, or None if it is proven that there is no such mate
+    with workers > 1 the root moves are shared out across a process pool, each worker receiving the packed board
+    '''
+    if TABLEBASES:
+        from chess_tablebase import probe
+        result = probe(B, True)
+        if result is not None:
+            return tablebase_line(B, n) if result[0] == "win" and result[1] <= 2 * n - 1 else None
+    root_moves = legal_moves(True, B)
+    packed = pack_board(B)
+    pool = Pool(workers) if workers > 1 else None
+    try:
+        for depth in range(1, n + 1):
+            tasks = [(packed, move, depth) for move in root_moves]
+            results = pool.imap(_solve_root, tasks) if pool is not None else map(_solve_root, tasks)
+            for line in results:
+                if line is not None:
+                    return [move2str(move) for move in line]
+        return None
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+def tablebase_line(B : Board, n : int) -> Optional[list[str]]:
+    '''
+    returns the mating line the loaded tablebases give for White to move on B, playing it out on B and taking it back,
+    or None if it is longer than n White moves or leaves the tables
+    '''
+    from chess_tablebase import best_move
+    line : list[Move] = []
+    undos = []
+    side = True
+    try:
+        while len(line) < 2 * n - 1:
+            move = best_move(side, B)
+            if move is None:
+                return None
+            piece, x, y = move
+            line.append((piece.pos_x, piece.pos_y, x, y))
+            undos.append(make_move(piece, x, y, B))
+            if is_checkmate(not side, B):
+                return [move2str(move) for move in line] if side else None
+            side = not side
+        return None
+    finally:
+        for undo in reversed(undos):
+            unmake_move(undo, B)
+
+def main(argv : Optional[Sequence[str]] = None) -> None:
+    ''' solves the board in a plain board file for a forced White mate '''
+    parser = argparse.ArgumentParser(description="Find a forced mate for White in a plain board configuration.")
+    parser.add_argument("filename", help="plain board configuration file")
+    parser.add_argument("n", type=int, help="maximum number of White moves")
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes")
+    args = parser.parse_args(argv)
+    line = solve_mate(read_board(args.filename), args.n, workers=args.workers)
+    if line is None:
+        print(f"No mate in {args.n}.")
+    else:
+        print(f"Mate in {(len(line) + 1) // 2}: {' '.join(line)}")
+
+if __name__ == '__main__':
+    main()
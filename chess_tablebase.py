@@ -0,0 +1,304 @@
+import argparse
+import mmap
+import os
+from array import array
+from typing import Iterator, Optional, Sequence, Tuple
+
+from chess_puzzle_final import (TABLEBASES, Bishop, Board, King, Piece, PieceList, Rook, generate_legal_moves, geometry,
+                                is_check, is_piece_at, make_move, unmake_move)
+
+# Endgame tablebases built by retrograde analysis under the rules of the game (Rule1-Rule5, no castling):
+# a side to move without a legal move has lost, and a capture that leaves only the two kings is a draw
+# unless the side to move is then left without a legal move.
+#
+# A table covers one material signature, e.g. "KRvK", on one board size. Every placement of its pieces
+# (one square per piece, in signature order) and side to move has one byte:
+#   0         draw
+#   1 - 254   decided: the game ends in mate after value - 1 plies; an even count means the side to move
+#             is mated (a loss), an odd one that it mates (a win)
+#   255       illegal (two pieces on one square, or the side not to move in check)
+
+DRAW = 0
+ILLEGAL = 255
+MAGIC = b"CPTB1"
+
+Slots = list[tuple[str, bool]] # (letter, side) of every piece of a signature, in order
+
+def parse_signature(signature : str) -> Slots:
+    '''
+    converts a material signature such as "KRvKB" to its pieces, White first, each side's king first
+    raises ValueError if it does not give each side exactly one king plus rooks and bishops
+    '''
+    sides = signature.split("v")
+    if len(sides) != 2:
+        raise ValueError(f"invalid material signature {signature!r}")
+    slots = []
+    for side, letters in zip((True, False), sides):
+        if letters.count("K") != 1 or not set(letters) <= set("KRB"):
+            raise ValueError(f"invalid material signature {signature!r}")
+        slots += [(letter, side) for letter in sorted(letters, key="KRB".index)]
+    return slots
+
+def slots2signature(slots : Slots) -> str:
+    '''converts the pieces of a signature back to its canonical string'''
+    return "v".join("".join(letter for letter, piece_side in slots if piece_side == side) for side in (True, False))
+
+def board_signature(B : Board) -> str:
+    '''returns the canonical material signature of board B'''
+    return slots2signature(sorted(((piece.letter, piece.side) for piece in B[1]), key=lambda slot: (not slot[1], "KRB".index(slot[0]))))
+
+def board_index(B : Board, side : bool, slots : Slots) -> int:
+    '''returns the table index of board B with side to move, for a table of the given slots (same material as B)'''
+    size = B[0]
+    kinds : dict[tuple[str, bool], list[int]] = {}
+    for piece in B[1]:
+        kinds.setdefault((piece.letter, piece.side), []).append((piece.pos_y - 1) * size + piece.pos_x - 1)
+    for squares in kinds.values():
+        squares.sort(reverse=True)
+    placement = 0
+    for letter_side in reversed(slots):
+        placement = placement * size * size + kinds[letter_side].pop()
+    return placement * 2 + (0 if side else 1)
+
+def decode(placement : int, k : int, n : int) -> list[int]:
+    '''returns the square of each of the k slots of a placement on a board of n squares'''
+    squares = []
+    for _ in range(k):
+        placement, square = divmod(placement, n)
+        squares.append(square)
+    return squares
+
+def slots2board(slots : Slots, squares : Sequence[int], size : int) -> Board:
+    '''builds the board with the pieces of slots on the given squares'''
+    piece_classes = {"K": King, "R": Rook, "B": Bishop}
+    return (size, PieceList([piece_classes[letter](square % size + 1, square // size + 1, side)
+                             for (letter, side), square in zip(slots, squares)]))
+
+def unmoves(slots : Slots, squares : list[int], side : bool, size : int) -> Iterator[list[int]]:
+    '''
+    yields the placements from which side could have reached squares with a move that captured nothing:
+    every piece of side is moved back along its rays (or to its king neighbourhood) over empty squares
+    '''
+    table = geometry(size)
+    occupied = {(square % size + 1, square // size + 1) for square in squares}
+    for i, (letter, piece_side) in enumerate(slots):
+        if piece_side != side:
+            continue
+        square = (squares[i] % size + 1, squares[i] // size + 1)
+        if letter == "K":
+            origins = [origin for origin in table.neighbours[square] if origin not in occupied]
+        else:
+            origins = []
+            for direction in (Rook if letter == "R" else Bishop).directions:
+                for origin in table.rays[direction][square]:
+                    if origin in occupied:
+                        break
+                    origins.append(origin)
+        for x, y in origins:
+            previous = list(squares)
+            previous[i] = (y - 1) * size + x - 1
+            yield previous
+
+def encode(squares : Sequence[int], n : int) -> int:
+    '''converts the squares of the slots back to a placement'''
+    placement = 0
+    for square in reversed(squares):
+        placement = placement * n + square
+    return placement
+
+def build_table(signature : str, size : int, tables : Optional[dict[str, bytearray]] = None) -> bytearray:
+    '''
+    returns the values of every index of the table of signature on boards of the given size, building the tables
+    of the signatures reached by captures first; tables maps signatures to tables already built and receives them all
+    '''
+    tables = {} if tables is None else tables
+    slots = parse_signature(signature)
+    signature = slots2signature(slots)
+    if signature in tables:
+        return tables[signature]
+    k, n = len(slots), size * size
+    count = n ** k
+    values = bytearray(2 * count)
+    remaining = array("H", bytes(4 * count)) # moves not capturing anything whose outcome is still unknown
+    blocked = bytearray(2 * count) # 1 when a capture already reaches a draw or a win, so the position cannot be lost
+    capture_loss = bytearray(2 * count) # the longest loss, in plies, among captures reaching a win for the opponent
+    buckets : dict[int, list[tuple[int, bool]]] = {} # plies -> (index, is a win) candidates
+    for placement in range(count):
+        squares = decode(placement, k, n)
+        if len(set(squares)) < k:
+            values[2 * placement] = values[2 * placement + 1] = ILLEGAL
+            continue
+        B = slots2board(slots, squares, size)
+        for side in (True, False):
+            index = 2 * placement + (0 if side else 1)
+            if is_check(not side, B):
+                values[index] = ILLEGAL
+                continue
+            moves = list(generate_legal_moves(side, B))
+            if not moves:
+                buckets.setdefault(0, []).append((index, False))
+                continue
+            if k == 2: # only the kings: the game is a draw
+                continue
+            for piece, x, y in moves:
+                if not is_piece_at(x, y, B):
+                    remaining[index] += 1
+                    continue
+                undo = make_move(piece, x, y, B)
+                sub_slots = [(other.letter, other.side) for other in B[1]]
+                sub_slots.sort(key=lambda slot: (not slot[1], "KRB".index(slot[0])))
+                child = build_table(slots2signature(sub_slots), size, tables)[board_index(B, not side, sub_slots)]
+                unmake_move(undo, B)
+                if child == DRAW:
+                    blocked[index] = 1
+                elif child % 2 == 1: # the opponent is mated after child - 1 plies
+                    blocked[index] = 1
+                    buckets.setdefault(child, []).append((index, True))
+                else:
+                    capture_loss[index] = max(capture_loss[index], child)
+            if remaining[index] == 0 and not blocked[index]:
+                buckets.setdefault(capture_loss[index], []).append((index, False))
+
+    plies = 0
+    while buckets:
+        for index, win in buckets.pop(plies, []):
+            if values[index] != DRAW:
+                continue
+            if plies + 1 >= ILLEGAL:
+                raise ValueError(f"{signature} on {size}x{size} needs more than {ILLEGAL - 2} plies")
+            values[index] = plies + 1
+            if k == 2: # only the kings: no move is ever played from these positions
+                continue
+            placement, side = index // 2, index % 2 == 0
+            for previous in unmoves(slots, decode(placement, k, n), not side, size):
+                previous_index = 2 * encode(previous, n) + (1 if side else 0)
+                if values[previous_index] != DRAW:
+                    continue
+                if not win:
+                    buckets.setdefault(plies + 1, []).append((previous_index, True))
+                else:
+                    remaining[previous_index] -= 1
+                    if remaining[previous_index] == 0 and not blocked[previous_index]:
+                        loss = max(plies + 1, capture_loss[previous_index])
+                        buckets.setdefault(loss, []).append((previous_index, False))
+        plies += 1
+    tables[signature] = values
+    return values
+
+def table_path(directory : str, signature : str, size : int) -> str:
+    '''returns the path of the table file of signature on boards of the given size'''
+    return os.path.join(directory, f"{signature}_{size}.cptb")
+
+def write_table(path : str, signature : str, size : int, values : bytearray) -> None:
+    '''writes a table file: magic, board size, signature length, signature, then one byte per index'''
+    encoded = signature.encode("ascii")
+    with open(path, "wb") as table_file:
+        table_file.write(MAGIC + bytes([size, len(encoded)]) + encoded + values)
+
+def build_tablebase(signature : str, size : int, directory : str = ".") -> list[str]:
+    '''builds the table of signature and of every signature reached by captures, writes them to directory and returns their paths'''
+    tables : dict[str, bytearray] = {}
+    build_table(signature, size, tables)
+    paths = []
+    for sub_signature, values in tables.items():
+        path = table_path(directory, sub_signature, size)
+        write_table(path, sub_signature, size, values)
+        paths.append(path)
+    return paths
+
+class Tablebase:
+    '''
+    a table file, memory-mapped so that probes read single bytes without loading the file
+    raises IOError exception if the file is not a table file or is truncated
+    '''
+
+    def __init__(self, path : str):
+        with open(path, "rb") as table_file:
+            if os.fstat(table_file.fileno()).st_size == 0: # an empty file cannot be mapped
+                raise IOError(f"{path} is not a tablebase file")
+            self.data = mmap.mmap(table_file.fileno(), 0, access=mmap.ACCESS_READ)
+        start = len(MAGIC) + 2
+        if self.data[:len(MAGIC)] != MAGIC:
+            self.data.close()
+            raise IOError(f"{path} is not a tablebase file")
+        if len(self.data) < start or len(self.data) < start + self.data[start - 1]:
+            self.data.close()
+            raise IOError(f"{path} is a truncated tablebase file")
+        self.size = self.data[start - 2]
+        length = self.data[start - 1]
+        try:
+            self.signature = self.data[start:start + length].decode("ascii")
+            self.slots = parse_signature(self.signature)
+        except ValueError: # UnicodeDecodeError included
+            self.data.close()
+            raise IOError(f"{path} is not a tablebase file")
+        self.offset = start + length
+        if len(self.data) < self.offset + 2 * (self.size * self.size) ** len(self.slots):
+            self.data.close()
+            raise IOError(f"{path} is a truncated tablebase file")
+
+    def value(self, B : Board, side : bool) -> int:
+        '''returns the stored byte of board B with side to move'''
+        return self.data[self.offset + board_index(B, side, self.slots)]
+
+def load_tablebase(path : str) -> Tablebase:
+    '''memory-maps a table file and registers it so that probe (and the move pickers using it) can find it'''
+    table = Tablebase(path)
+    TABLEBASES[(table.size, table.signature)] = table
+    return table
+
+def load_tablebases(directory : str) -> None:
+    '''loads every table file of directory'''
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".cptb"):
+            load_tablebase(os.path.join(directory, name))
+
+def probe(B : Board, side : bool) -> Optional[tuple[str, int]]:
+    '''
+    returns ("win", plies), ("loss", plies) or ("draw", 0) for side to move on B, plies being the distance to mate,
+    or None when no loaded table covers B or B is illegal
+    '''
+    table = TABLEBASES.get((B[0], board_signature(B)))
+    if table is None:
+        return None
+    value = table.value(B, side)
+    if value == ILLEGAL:
+        return None
+    if value == DRAW:
+        return ("draw", 0)
+    return ("win" if (value - 1) % 2 == 1 else "loss", value - 1)
+
+def best_move(side : bool, B : Board) -> Optional[Tuple[Piece, int, int]]:
+    '''
+    returns the move (P, x, y) of side on B the tables rate best: the quickest mate when winning,
+    a drawing move when drawn and the longest resistance when losing; None when B or a reply is not covered
+    '''
+    if probe(B, side) is None:
+        return None
+    best, best_rank = None, None
+    for piece, x, y in list(generate_legal_moves(side, B)):
+        undo = make_move(piece, x, y, B)
+        try:
+            result = probe(B, not side)
+        finally:
+            unmake_move(undo, B)
+        if result is None:
+            return None
+        kind, plies = result
+        rank = (0, plies) if kind == "loss" else (1, 0) if kind == "draw" else (2, -plies)
+        if best_rank is None or rank < best_rank:
+            best, best_rank = (piece, x, y), rank
+    return best
+
+def main(argv : Optional[Sequence[str]] = None) -> None:
+    ''' builds the tablebase of a material signature for one board size '''
+    parser = argparse.ArgumentParser(description="Build an endgame tablebase by retrograde analysis.")
+    parser.add_argument("signature", help="material signature, e.g. KRvK or KRvKB")
+    parser.add_argument("size", type=int, help="board size")
+    parser.add_argument("--directory", default=".", help="directory to write the table files to")
+    args = parser.parse_args(argv)
+    for path in build_tablebase(args.signature, args.size, args.directory):
+        print(f"wrote {path}")
+
+if __name__ == '__main__':
+    main()
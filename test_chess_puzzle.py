@@ -1,3 +1,4 @@
+import os
 import pytest
 from chess_puzzle import *
 
@@ -74,3 +75,530 @@ def test_read_board1():
 def test_conf2unicode1():
     assert conf2unicode(B1) == "♖ ♔  \n ♜  ♜\n ♚ ♜ \n♖   ♗\n♗    "
     
+
+def test_piece_list_index1():
+    B = read_board("board_examp.txt")
+    assert isinstance(B[1], PieceList)
+    rook = piece_at(1, 5, B)
+    rook.move_to(1, 4, B)
+    assert is_piece_at(1, 4, B) == True
+    assert is_piece_at(1, 5, B) == False
+    assert piece_at(1, 4, B) == rook
+
+def test_piece_list_index2():
+    B = indexed_board(B1)
+    assert B[1] == B1[1]
+    for piece in B1[1]:
+        assert piece_at(piece.pos_x, piece.pos_y, B) == piece_at(piece.pos_x, piece.pos_y, B1)
+
+def test_make_unmake_move1():
+    B = read_board("board_examp.txt")
+    before = [(repr(piece), piece.pos_x, piece.pos_y) for piece in B[1]]
+    rook = piece_at(1, 2, B) # white rook a2 -> b2
+    undo = make_move(rook, 2, 2, B)
+    assert piece_at(2, 2, B) == rook and not is_piece_at(1, 2, B)
+    unmake_move(undo, B)
+    assert [(repr(piece), piece.pos_x, piece.pos_y) for piece in B[1]] == before
+
+def test_make_unmake_move2():
+    B = read_board("board_examp.txt")
+    before = [(repr(piece), piece.pos_x, piece.pos_y) for piece in B[1]]
+    black_rook = piece_at(4, 3, B)
+    undo = make_move(black_rook, 4, 4, B) # nothing to capture, d3 -> d4
+    unmake_move(undo, B)
+    white_bishop = piece_at(5, 2, B)
+    undo = make_move(white_bishop, 4, 3, B) # e2 captures the rook on d3
+    assert len(B[1]) == 8 and piece_at(4, 3, B) == white_bishop
+    unmake_move(undo, B)
+    assert [(repr(piece), piece.pos_x, piece.pos_y) for piece in B[1]] == before
+    assert piece_at(4, 3, B) == black_rook
+
+def test_generate_legal_moves1():
+    moves = {(repr(piece), x, y) for piece, x, y in generate_legal_moves(False, B1)}
+    expected = {(repr(piece), x, y) for piece in B1[1] if piece.side == False for x in range(1, 6) for y in range(1, 6) if piece.can_move_to(x, y, B1)}
+    assert moves == expected
+
+def test_find_black_move1():
+    piece, x, y = find_black_move(B1)
+    assert piece.side == False and piece.can_move_to(x, y, B1)
+
+def random_board(size, piece_count, rng):
+    '''returns a random board of the given size with both kings and piece_count rooks and bishops'''
+    squares = rng.sample([(x, y) for x in range(1, size+1) for y in range(1, size+1)], piece_count + 2)
+    pieces = [King(squares[0][0], squares[0][1], True), King(squares[1][0], squares[1][1], False)]
+    for x, y in squares[2:]:
+        pieces.append(rng.choice([Rook, Bishop])(x, y, rng.random() < 0.5))
+    return (size, pieces)
+
+def test_bitboard_engine1():
+    import random
+    import chess_bitboard
+    rng = random.Random(4)
+    for _ in range(60):
+        size = rng.choice([2, 3, 5, 8])
+        B = random_board(size, rng.randint(0, min(6, size*size - 2)), rng)
+        for side in (True, False):
+            assert chess_bitboard.is_check(side, B) == is_check(side, B)
+            assert chess_bitboard.is_checkmate(side, B) == is_checkmate(side, B)
+        for piece in B[1]:
+            for x, y in get_squares(B):
+                assert chess_bitboard.can_move_to(piece, x, y, B) == piece.can_move_to(x, y, B)
+
+def test_set_engine1():
+    set_engine("bitboard")
+    try:
+        assert is_checkmate(True, (5, [wb1, wr1, wb2, bk, br1, Rook(4,5,False), br3, wr2, wk])) == True
+        assert wr2a.can_move_to(2,4, (5, [wb1, wr1, wb2, bk, br1, br2a, br3, wr2a, wk])) == False
+    finally:
+        set_engine("pieces")
+    with pytest.raises(ValueError):
+        set_engine("abacus")
+
+def test_is_check2():
+    B = (5, [King(3,3,True), Rook(3,5,False), Bishop(5,5,False), King(1,1,False)])
+    assert is_check(True, B) == True
+    B = (5, [King(3,3,True), Rook(3,5,False), Bishop(3,4,True), Bishop(4,5,False), King(1,1,False)])
+    assert is_check(True, B) == False
+
+def test_track_attacks1():
+    import random
+    rng = random.Random(5)
+    for _ in range(20):
+        size = rng.choice([4, 6, 8])
+        B = track_attacks(random_board(size, rng.randint(0, 8), rng))
+        if is_check(False, B): # Black to move next must not be left in check
+            continue
+        side = True
+        for _ in range(6):
+            moves = [(piece, x, y) for piece, x, y in generate_legal_moves(side, B)]
+            if not moves:
+                break
+            piece, x, y = rng.choice(moves)
+            piece.move_to(x, y, B)
+            side = not side
+            fresh = (size, list(B[1]))
+            for check_side in (True, False):
+                assert is_check(check_side, B) == is_check(check_side, fresh)
+            assert B[1].attack_map.targets == AttackMap(fresh).targets
+
+def test_geometry1():
+    table = geometry(5)
+    assert geometry(5) is table
+    assert table.rays[(1, 1)][(3, 2)] == ((4, 3), (5, 4))
+    assert table.rays[(0, -1)][(2, 3)] == ((2, 2), (2, 1))
+    assert set(table.neighbours[(1, 1)]) == {(1, 2), (2, 1), (2, 2)}
+    assert get_squares(B1) == [(x, y) for x in range(1, 6) for y in range(1, 6)]
+
+def test_search_player1():
+    from chess_search import SearchPlayer
+    # Black to move mates at once with Rd1: the black king on b3 covers a2 and b2
+    B = (4, [King(1,1,True), King(2,3,False), Rook(4,2,False)])
+    player = SearchPlayer(time_limit=5, max_depth=3)
+    piece, x, y = player(B)
+    assert piece.can_move_to(x, y, B)
+    assert (piece.pos_x, piece.pos_y, x, y) == (4, 2, 4, 1)
+    assert player.stats["nodes"] > 0
+
+def test_zobrist_hash1():
+    from chess_search import zobrist_hash
+    B = read_board("board_examp.txt")
+    key = zobrist_hash(B, True)
+    assert zobrist_hash(B, False) != key
+    undo = make_move(piece_at(1, 2, B), 2, 2, B)
+    assert zobrist_hash(B, True) != key
+    unmake_move(undo, B)
+    assert zobrist_hash(B, True) == key
+
+def test_solve_mate1():
+    from chess_solver import solve_mate
+    B = (4, [King(1,1,False), King(2,3,True), Rook(4,2,True)])
+    assert solve_mate(B, 1) == ["d2d1"]
+    assert solve_mate(B, 2, workers=2) == ["d2d1"]
+
+def test_solve_mate2():
+    from chess_solver import solve_mate
+    B = read_board("board_examp.txt")
+    assert solve_mate(B, 1) == ["a5a3"]
+    B = (4, [King(1,1,False), King(3,3,True), Rook(4,4,True)])
+    line = solve_mate(B, 2)
+    assert line is not None and len(line) == 3
+    assert solve_mate(B, 2, workers=2) == line
+    assert solve_mate(B, 1) is None
+
+def test_conf2unicode_diff1():
+    import re
+    B = (5, PieceList([Bishop(1,1,True), Rook(1,2,True), Bishop(5,2,True), King(2,3,False), Rook(4,3,False), Rook(2,4,False),
+                       Rook(5,4,False), Rook(1,5,True), King(3,5,True)]))
+    before = Position.from_board(B)
+    screen = [list(row) for row in conf2unicode(B).split("\n")]
+    B[1][1].move_to(4, 2, B) # a2d2
+    B[1][0].move_to(2, 2, B) # a1b2
+    update = conf2unicode_diff(before, Position.from_board(B), top_line=3)
+    cells = re.findall(r"\x1b\[(\d+);(\d+)H([^\x1b]?)", update)
+    assert len(cells) == 5 and cells[-1] == ("8", "1", "")
+    for line, column, cell in cells[:-1]:
+        screen[int(line) - 3][int(column) - 1] = cell
+    assert "\n".join("".join(row) for row in screen) == conf2unicode(B)
+    assert conf2unicode_diff(None, Position.from_board(B)).count("H") == 26
+
+def test_parse_board1():
+    B = parse_board(["5\n", "Ba1, Ra2, Be2, Ra5, Kc5\n", "Kb3, Rd3, Rb4, Re4\n"])
+    assert conf2unicode(B) == conf2unicode(B1)
+    with pytest.raises(IOError, match="two pieces on b3"):
+        parse_board(["5\n", "Ka1, Rb3\n", "Kb3\n"])
+    with pytest.raises(IOError, match="exactly one king"):
+        parse_board(["5\n", "Ra1\n", "Kb3\n"])
+
+def test_parse_board2():
+    for size in ("0\n", "27\n", "x\n"):
+        with pytest.raises(IOError):
+            parse_board([size, "Ka1\n", "Kb3\n"])
+    with pytest.raises(IOError, match="invalid White piece 'Qb2'"):
+        parse_board(["5\n", "Ka1, Qb2\n", "Kb3\n"])
+
+def test_read_boards1(tmp_path):
+    path = tmp_path / "boards.txt"
+    path.write_text(open("board_examp.txt").read() + "\n4\nKa1, Rd2\nKa3\n")
+    boards = list(read_boards(str(path)))
+    assert [B[0] for B in boards] == [5, 4] and conf2unicode(boards[0]) == conf2unicode(B1)
+    path.write_text("4\nKa1, Rd2\nKa3\n4\nKa1\nKa1\n")
+    with pytest.raises(IOError, match="board configuration 2: two pieces on a1"):
+        list(read_boards(str(path)))
+    path.write_text("")
+    assert list(read_boards(str(path))) == []
+
+def test_save_board_binary1(tmp_path):
+    path = str(tmp_path / "board.bin")
+    save_board_binary(path, B1)
+    assert os.path.getsize(path) == 1 + 2 * len(B1[1])
+    assert conf2unicode(read_board_binary(path)) == conf2unicode(B1)
+    with open(path, "wb") as out:
+        out.write(bytes([5, 0, 0, 0, 0]))
+    with pytest.raises(IOError, match="two pieces on a1"):
+        read_board_binary(path)
+
+def test_board_archive1(tmp_path):
+    plain, archive_path, back = (str(tmp_path / name) for name in ("in.txt", "boards.cpba", "out.txt"))
+    boards = [B1, (26, [King(26,26,True), King(1,1,False), Rook(13,2,True)])]
+    with open(plain, "w") as out:
+        out.write("".join(board2str(B) for B in boards))
+    assert plain2binary(plain, archive_path) == 2
+    with BoardArchive(archive_path) as archive:
+        assert len(archive) == 2
+        assert conf2unicode(archive[-1]) == conf2unicode(boards[1]) and conf2unicode(archive[0]) == conf2unicode(B1)
+        with pytest.raises(IndexError):
+            archive[2]
+    assert binary2plain(archive_path, back) == 2
+    assert [conf2unicode(B) for B in read_boards(back)] == [conf2unicode(B) for B in boards]
+
+def test_batch_validate1(tmp_path):
+    from chess_batch import iter_paths, iter_records, validate_stream
+    (tmp_path / "a.txt").write_text(open("board_examp.txt").read())
+    (tmp_path / "b.txt").write_text("4\nKa1, Rd2\nKa3\n\n3\nKa1\nKa2\n")
+    (tmp_path / "c.txt").write_text("5\nKa1\nKc3, Rz9\n")
+    results = list(validate_stream(iter_records(iter_paths(str(tmp_path))), workers=2))
+    assert [result["source"][len(str(tmp_path))+1:] for result in results] == ["a.txt", "b.txt", "b.txt#1", "c.txt"]
+    assert [result["valid"] for result in results] == [True, True, False, False]
+    assert results[1]["white"] == "normal" and results[1]["black"] == "normal"
+    assert results[3]["reason"] == "Rz9 is off the 5x5 board"
+
+def test_slots1():
+    with pytest.raises(AttributeError):
+        wb1.colour = "white"
+    assert wb1.piece_code == "♗" and bk.piece_code == "♚"
+
+def test_position1():
+    import pickle
+    position = Position.from_board(B1)
+    assert position == Position.from_board(read_board("board_examp.txt"))
+    assert position != Position.from_board(B1, white_to_move=False)
+    assert len({position, Position.from_board(B1)}) == 1
+    assert pickle.loads(pickle.dumps(position)) == position
+    B = position.to_board()
+    assert conf2unicode(B) == conf2unicode(B1)
+    assert Position.from_board(B) == position
+    with pytest.raises(AttributeError):
+        position.size = 6
+
+def test_perft1():
+    import json
+    from bench_chess_puzzle import BASELINE_FILE, perft, reference_positions
+    with open(BASELINE_FILE) as baseline_file:
+        baseline = json.load(baseline_file)
+    for name, (B, depth) in reference_positions().items():
+        if baseline[name]["nodes"] < 5000: # the larger counts are left to the benchmark run itself
+            assert perft(B, True, depth) == baseline[name]["nodes"]
+
+def test_bench_compare1():
+    from bench_chess_puzzle import compare
+    baseline = {"p": {"depth": 2, "nodes": 10, "is_check_per_second": 100.0}}
+    assert compare({"p": {"depth": 2, "nodes": 10, "is_check_per_second": 60.0}}, baseline, 0.5) == []
+    assert len(compare({"p": {"depth": 2, "nodes": 11, "is_check_per_second": 40.0}}, baseline, 0.5)) == 2
+
+def test_tablebase1(tmp_path):
+    from chess_tablebase import build_tablebase, load_tablebases, probe
+    from chess_solver import solve_mate
+    build_tablebase("KRvK", 4, str(tmp_path))
+    mate_in_1 = (4, [King(1,1,False), King(2,3,True), Rook(4,2,True)])
+    mate_in_2 = (4, [King(1,1,False), King(3,3,True), Rook(4,4,True)])
+    load_tablebases(str(tmp_path))
+    try:
+        assert probe(mate_in_1, True) == ("win", 1)
+        assert probe(mate_in_2, True) == ("win", 3)
+        assert probe(B1, True) is None
+        line = solve_mate(mate_in_2, 2)
+        assert len(line) == 3 and solve_mate(mate_in_2, 1) is None
+        piece, x, y = find_black_move(mate_in_2)
+        assert piece.side == False and piece.can_move_to(x, y, mate_in_2)
+    finally:
+        TABLEBASES.clear()
+
+def test_play_game1():
+    B = (4, PieceList([King(1,1,False), King(2,3,True), Rook(4,4,True)]))
+    moves = []
+    result = play_game(B, scripted_player(["d4d1"]), find_black_move, on_move=lambda side, move, B: moves.append(move))
+    assert result == ("white", 1) and moves == ["d4d1"]
+    B = (4, PieceList([King(1,1,False), King(3,3,True), Rook(4,4,True)]))
+    assert play_game(B, random_player(True), find_black_move, max_moves=0) == ("draw", 0)
+    with pytest.raises(IOError):
+        play_game(B, scripted_player(["d4a4"]), find_black_move)
+
+def test_arena1():
+    from chess_arena import run_arena
+    first = run_arena(B1, 20, max_moves=30, seed=3)
+    second = run_arena(B1, 20, max_moves=30, seed=3, workers=2)
+    counts = ("white_wins", "black_wins", "draws", "average_moves")
+    assert [first[key] for key in counts] == [second[key] for key in counts]
+    assert first["white_wins"] + first["black_wins"] + first["draws"] == 20
+
+def test_profile1():
+    import chess_profile
+    import chess_puzzle_final
+    original = chess_puzzle_final.is_check
+    profiler = chess_profile.enable()
+    try:
+        B = (4, PieceList([King(1,1,False), King(3,3,True), Rook(4,4,True)]))
+        chess_puzzle_final.play_game(B, chess_puzzle_final.random_player(True), chess_puzzle_final.find_black_move,
+                                     max_moves=4, on_move=lambda side, move, B: profiler.end_move(move))
+    finally:
+        assert chess_profile.disable() is profiler
+    assert chess_puzzle_final.is_check is original and chess_profile.profiler() is None
+    summary = profiler.summary()
+    assert len(summary["moves"]) == summary["measures"]["is_checkmate nodes"]["count"] == summary["functions"]["is_checkmate"]["calls"]
+    assert summary["measures"]["find_black_move candidates"]["count"] == summary["functions"].get("find_black_move", {"calls": 0})["calls"]
+    assert summary["functions"]["is_check"]["calls"] > 0 and "is_checkmate nodes" in profiler.table()
+
+def test_server1():
+    import asyncio
+    from chess_server import start_server
+    from chess_loadtest import load_test, request
+    async def play():
+        server = await start_server(port=0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            with pytest.raises(IOError, match="no board loaded"):
+                await request(reader, writer, ["MOVE d4d1"])
+            assert len(await request(reader, writer, ["LOAD", "4", "Kb3, Rd4", "Ka1"])) == 4
+            with pytest.raises(IOError, match="not a valid move"):
+                await request(reader, writer, ["MOVE d4b3"])
+            lines = await request(reader, writer, ["MOVE d4d1"])
+            assert lines == ["RESULT white"] + conf2unicode((4, [King(2,3,True), Rook(4,1,True), King(1,1,False)])).split("\n")
+            await request(reader, writer, ["QUIT"])
+            writer.close()
+            return await load_test("127.0.0.1", port, open("board_examp.txt").readlines(), 5, 3)
+    summary = asyncio.run(play())
+    assert summary["requests"] >= 10 and summary["p50_ms"] <= summary["p99_ms"] <= summary["max_ms"]
+
+def test_numpy_batch1():
+    pytest.importorskip("numpy")
+    import random
+    from chess_numpy import attack_masks, boards2tensor, is_check_batch, is_checkmate_batch, legal_move_counts
+    rng = random.Random(19)
+    for size in (2, 3, 5, 8):
+        boards = [random_board(size, rng.randint(0, min(8, size*size - 2)), rng) for _ in range(40)]
+        T = boards2tensor(boards)
+        for side in (True, False):
+            assert list(is_check_batch(T, side)) == [is_check(side, B) for B in boards]
+            assert list(legal_move_counts(T, side, chunk=7)) == [len(list(generate_legal_moves(side, B))) for B in boards]
+            assert list(is_checkmate_batch(T, side)) == [is_checkmate(side, B) for B in boards]
+            masks = attack_masks(T, side)
+            for mask, B in zip(masks, boards):
+                attacked = {square for piece in B[1] if piece.side == side for square in piece.attacked_squares(B)}
+                assert {(x + 1, y + 1) for y, x in zip(*mask.nonzero())} == attacked
+    with pytest.raises(ValueError):
+        boards2tensor([B1, random_board(3, 0, rng)])
+
+def test_generate_puzzles1(tmp_path):
+    from chess_generator import generate_puzzles
+    from chess_solver import solve_mate
+    summary = generate_puzzles(4, "KRvK", 1, 3, str(tmp_path), seed=1)
+    assert summary["puzzles"] == 3 and 0 < summary["acceptance_rate"] <= 1
+    boards = [read_board(str(tmp_path / f"puzzle_{k}.txt")) for k in (1, 2, 3)]
+    assert len({Position.from_board(B) for B in boards}) == 3
+    for B in boards:
+        assert not is_check(False, B) and len(solve_mate(B, 1)) == 1
+    assert generate_puzzles(4, "KvK", 1, 1, str(tmp_path / "none"), max_samples=64)["puzzles"] == 0
+
+def test_king_safety1():
+    import random
+    rng = random.Random(21)
+    for _ in range(150):
+        size = rng.choice([3, 5, 8])
+        B = random_board(size, rng.randint(0, min(10, size*size - 2)), rng)
+        for side in (True, False):
+            moves = sorted((P.pos_x, P.pos_y, x, y) for P, x, y in generate_legal_moves(side, B))
+            assert moves == sorted((P.pos_x, P.pos_y, x, y) for P, x, y in generate_legal_moves_by_trial(side, B))
+        for piece in B[1]:
+            for x, y in get_squares(B):
+                assert piece.can_move_to(x, y, B) == (piece.can_reach(x, y, B) and is_legal_by_trial(piece, x, y, B))
+    B = (5, [King(1,1,True), Rook(1,3,True), Rook(1,5,False), Bishop(3,3,False), King(5,5,False)])
+    pins, checkers, check_squares = king_safety(True, B)
+    assert pins == {B[1][1]: {(1,2), (1,3), (1,4), (1,5)}} and checkers == [B[1][3]] and check_squares == {(2,2), (3,3)}
+    assert {(P.pos_x, P.pos_y, x, y) for P, x, y in generate_legal_moves(True, B)} == {(1,1,1,2), (1,1,2,1)}
+
+def test_analysis_cache1():
+    import random
+    cache = AnalysisCache(2)
+    B = (4, PieceList([King(1,1,False), King(3,3,True), Rook(4,4,True)]))
+    moves, check, checkmate = cache.analyse(False, B)
+    assert set(moves) == {(P.pos_x, P.pos_y, x, y) for P, x, y in generate_legal_moves(False, B)} and not check and not checkmate
+    assert cache.analyse(False, B) == (moves, check, checkmate) and cache.stats()["hits"] == 1
+    cache.analyse(True, B)
+    B[1][2].move_to(4, 1, B)
+    assert cache.analyse(False, B)[1:] == (True, False) and cache.stats()["entries"] == 2
+    cache.analyse(False, (4, PieceList([King(1,1,False), King(3,3,True), Rook(4,4,True)])))
+    assert cache.stats() == {"hits": 1, "misses": 4, "hit_rate": 0.2, "entries": 2}
+    results = []
+    for use_cache in (None, AnalysisCache()):
+        set_analysis_cache(use_cache)
+        try:
+            random.seed(22)
+            B = (5, PieceList([King(3,5,True), Rook(1,5,True), King(2,3,False), Rook(4,3,False), Bishop(5,1,False)]))
+            results.append(play_game(B, random_player(True), find_black_move, max_moves=40))
+        finally:
+            set_analysis_cache(None)
+    assert results[0] == results[1] == ("black", 18) and use_cache.stats()["hits"] >= 9
+
+def test_parse_board3():
+    with pytest.raises(IOError, match="invalid White piece 'Ka²'"):
+        parse_board(["5\n", "Ka²\n", "Kb3\n"])
+
+def test_read_boards2(tmp_path):
+    path = tmp_path / "boards.txt"
+    path.write_bytes(b"4\nKa1, Rd2\nKa3\n4\nKa1\n\xffKa3\n")
+    with pytest.raises(IOError, match="line 6 is not valid UTF-8"):
+        list(read_boards(str(path)))
+
+def test_batch_validate2(tmp_path):
+    from chess_batch import iter_paths, iter_records, validate_stream
+    (tmp_path / "a.bin").write_bytes(b"4\nKa1, Rd2\n\xff\xfe\n\n4\nKa1, Rd2\nKa3\n")
+    (tmp_path / "b.txt").write_text("")
+    (tmp_path / "c.txt").write_text("4\nKa1, Rd2\n")
+    results = list(validate_stream(iter_records(iter_paths(str(tmp_path)))))
+    assert [result["source"][len(str(tmp_path))+1:] for result in results] == ["a.bin", "a.bin#1", "b.txt", "c.txt"]
+    assert [result["valid"] for result in results] == [False, True, False, False]
+    assert results[0]["reason"] == "cannot read file: not valid UTF-8"
+    assert results[3]["reason"] == "a board configuration needs three lines"
+
+def test_server2():
+    import asyncio
+    from chess_server import start_server
+    from chess_loadtest import request
+    async def play():
+        server = await start_server(port=0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            statuses = []
+            for line in (b"MOVE \xffa1\n", b"MOVE " + b"a" * 2**17 + b"\n", b"LOAD\n4\nKb3, Rd4\n\xff\n",
+                         b"LOAD\n\xff\nKb3, Rd4\nKa1\n"):
+                writer.write(line)
+                statuses.append((await reader.readline()).decode().strip())
+            assert len(await request(reader, writer, ["LOAD", "4", "Kb3, Rd4", "Ka1"])) == 4
+            await request(reader, writer, ["QUIT"])
+            writer.close()
+            return statuses
+    assert asyncio.run(play()) == ["ERR line is not valid UTF-8", "ERR line too long", "ERR line is not valid UTF-8",
+                                 "ERR line is not valid UTF-8"]
+
+def test_board_archive2(tmp_path):
+    path = tmp_path / "boards.cpba"
+    path.write_bytes(b"")
+    with pytest.raises(IOError, match="not a board archive"):
+        BoardArchive(str(path))
+    save_boards_binary(str(path), [])
+    with BoardArchive(str(path)) as archive:
+        assert len(archive) == 0 and list(archive) == []
+    path.write_bytes(path.read_bytes()[:-1])
+    with pytest.raises(IOError, match="truncated"):
+        BoardArchive(str(path))
+
+def test_generate_puzzles2(tmp_path):
+    from chess_generator import MAX_SAMPLES, generate_puzzles
+    with pytest.raises(ValueError, match="do not fit on a 2x2 board"):
+        generate_puzzles(2, "KRBvKB", 1, 1, str(tmp_path))
+    summary = generate_puzzles(2, "KvK", 1, 1, str(tmp_path), batch_size=5000)
+    assert summary["puzzles"] == 0 and summary["samples"] == MAX_SAMPLES
+
+def test_parse_board4():
+    B = parse_board(["5\n", "Ka1, Rb2,\n", "Ke5 ,  \n"])
+    assert conf2unicode(B) == conf2unicode((5, [King(1,1,True), Rook(2,2,True), King(5,5,False)]))
+    for white in ("Ka1,, Rb2\n", ", Ka1\n", "Ka1, Rb2,,\n"):
+        with pytest.raises(IOError, match="invalid White piece ''"):
+            parse_board(["5\n", white, "Ke5\n"])
+    with pytest.raises(IOError, match="not between 2 and 26"):
+        parse_board(["1\n", "Ka1\n", "Ka1\n"])
+
+def test_search_player2():
+    from bench_chess_puzzle import generated_board
+    from chess_search import SearchPlayer
+    size, pieces = generated_board(26, 22, 2626)
+    player = SearchPlayer(time_limit=0.1, side=True)
+    player((size, PieceList(pieces)))
+    assert player.stats["nodes"] > 0 and player.stats["seconds"] < 0.3
+
+def test_main_profile1(tmp_path, monkeypatch, capsys):
+    import chess_puzzle_final
+    (tmp_path / "board.txt").write_text(open("board_examp.txt").read())
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("CHESS_PROFILE", "table")
+    answers = iter(["board.txt", "QUIT", "saved.txt"])
+    monkeypatch.setattr("builtins.input", lambda prompt="": next(answers))
+    with pytest.raises(SystemExit):
+        chess_puzzle_final.main()
+    output = capsys.readouterr().out
+    assert "0 moves" in output and "Analysis cache:" in output
+    assert (tmp_path / "saved.txt").exists()
+
+def test_profile2():
+    import chess_profile
+    import chess_puzzle_final
+    B = read_board("board_examp.txt")
+    profiler = chess_profile.enable()
+    try:
+        for side in (True, False):
+            AnalysisCache(16).analyse(side, B)
+    finally:
+        chess_profile.disable()
+    checks = [len(list(chess_puzzle_final.generate_legal_moves_by_trial(side, B))) for side in (True, False)]
+    nodes = profiler.summary()["measures"]["analyse nodes"]
+    assert nodes["count"] == 2 and nodes["total"] >= sum(checks) == 29
+    assert nodes["total"] == profiler.calls["is_legal_by_trial"] + profiler.calls["is_safe_move"]
+
+def test_tablebase2(tmp_path):
+    from chess_tablebase import MAGIC, Tablebase, build_tablebase
+    path = tmp_path / "empty.cptb"
+    path.write_bytes(b"")
+    with pytest.raises(IOError, match="not a tablebase file"):
+        Tablebase(str(path))
+    path.write_bytes(b"CPBA1")
+    with pytest.raises(IOError, match="not a tablebase file"):
+        Tablebase(str(path))
+    table = [name for name in build_tablebase("KvK", 3, str(tmp_path)) if "KvK" in name][0]
+    data = open(table, "rb").read()
+    for length in (len(MAGIC) + 1, len(MAGIC) + 4, len(data) - 1):
+        path.write_bytes(data[:length])
+        with pytest.raises(IOError, match="truncated"):
+            Tablebase(str(path))
+    assert Tablebase(table).signature == "KvK"